@@ -1,18 +1,28 @@
 # backend/app.py
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional, List, Dict, Any, Literal
 import uvicorn
+import asyncio
 import time
 import traceback
 import inspect
+import itertools
+import threading
+import statistics
 import uuid
 import hashlib
-import json
+import hmac
+import sqlite3
 import base64
+import orjson
+import logging
 import os
+import jwt
 from datetime import datetime, timedelta
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
 from dotenv import load_dotenv
 
@@ -20,22 +30,52 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # dev-only: show full traceback in HTTP responses to help debugging
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, ORJSONResponse
 
 # Password hashing context
-# Use bcrypt_sha256 to avoid the 72-byte password limit and ensure compatibility
-pwd_context = CryptContext(schemes=["bcrypt_sha256"], deprecated="auto")
+# Use bcrypt_sha256 to avoid the 72-byte password limit and ensure compatibility.
+# Cost 10 (passlib default is 12) keeps a login at roughly a quarter of the CPU time;
+# existing cost-12 hashes still verify.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
+pwd_context = CryptContext(
+    schemes=["bcrypt_sha256"],
+    deprecated="auto",
+    bcrypt_sha256__default_rounds=BCRYPT_ROUNDS,
+)
+
+# Password hashing is CPU-bound; run it on its own pool so bcrypt work
+# doesn't queue behind (or starve) the default threadpool used for DB calls
+_HASH_EXECUTOR = ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) * 2, thread_name_prefix="pwd-hash")
+
+
+async def _run_hasher(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_HASH_EXECUTOR, fn, *args)
 
 # Configuration from environment
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-in-production")
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))
+FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
+# Comma-separated list of allowed browser origins
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", FRONTEND_URL).split(",") if o.strip()]
+
+# Auth flow logging: verbose debug output in development only. Uses lazy %-style
+# arguments so production skips the string formatting entirely.
+log = logging.getLogger("auth")
+log.setLevel(logging.INFO if ENVIRONMENT == "production" else logging.DEBUG)
+if not log.handlers:
+    log.addHandler(logging.StreamHandler())
+    log.propagate = False
 
 # Google OAuth verification library
 try:
     from google.oauth2 import id_token
     from google.auth.transport import requests as google_requests
     GOOGLE_AUTH_AVAILABLE = True
+    # One transport (and HTTP connection pool) for the whole process
+    _GOOGLE_HTTP = google_requests.Request()
 except ImportError:
     GOOGLE_AUTH_AVAILABLE = False
     print("⚠️  google-auth library not installed. Install with: pip install google-auth google-auth-httplib2")
@@ -44,11 +84,11 @@ except ImportError:
 # Import DB and services
 from db import (
     create_session as db_create_session,
-    add_message as db_add_message,
-    get_messages,
+    add_messages as db_add_messages,
+    get_messages_raw,
     get_sessions_for_user,
+    session_exists,
     delete_session,
-    update_session_title,
     get_user_by_id,
     get_user_by_email,
     create_email_user,
@@ -57,24 +97,25 @@ from db import (
     update_last_login,
     update_user_name,
     set_password_hash,
+    optimize as db_optimize,
+    OPTIMIZE_INTERVAL_S as DB_OPTIMIZE_INTERVAL_S,
 )
 import loader
-from retriever import retrieve_relevant_docs
+from retriever import retrieve_relevant_docs, prepare_text_index
 from llm_service import generate_legal_answer
 
-# Simple in-memory stats for admin monitoring
-_STATS = {
-    "requests": 0,
-    "last_retrieval_s": None,
-    "last_generation_s": None,
-    "avg_retrieval_s": None,
-    "avg_generation_s": None,
-}
+# Simple in-memory stats for admin monitoring: a request counter plus the most
+# recent durations; averages are computed on demand in /admin/stats
+_STATS_WINDOW = 512
+_REQUEST_COUNTER = itertools.count(1)
+_STATS = {"requests": 0}
+_RETRIEVAL_S = deque(maxlen=_STATS_WINDOW)
+_GENERATION_S = deque(maxlen=_STATS_WINDOW)
 
 # ---------------------------------------------------------
 # FastAPI Init
 # ---------------------------------------------------------
-app = FastAPI(title="LEXAI Backend API", version="1.0")
+app = FastAPI(title="LEXAI Backend API", version="1.0", default_response_class=ORJSONResponse)
 
 # Dev exception handler (print traceback in response)
 @app.exception_handler(Exception)
@@ -85,27 +126,45 @@ async def dev_exception_handler(request: Request, exc: Exception):
     print("===================================")
     return PlainTextResponse(tb, status_code=500)
 
+# ---------------------------------------------------------
+# Response compression (markdown answers / history lists)
+# ---------------------------------------------------------
+try:
+    from brotli_asgi import BrotliMiddleware
+    # falls back to gzip for clients that don't accept br
+    app.add_middleware(BrotliMiddleware, quality=4, minimum_size=1024)
+except ImportError:
+    from fastapi.middleware.gzip import GZipMiddleware
+    app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # ---------------------------------------------------------
 # CORS
+# Added last so it is the outermost middleware: preflights are answered
+# before compression runs. Browsers cache a preflight for max_age seconds.
 # ---------------------------------------------------------
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_headers=["authorization", "content-type"],
+    max_age=86400,
 )
 
 # ---------------------------------------------------------
 # Request / Response Models
 # ---------------------------------------------------------
-class ChatRequest(BaseModel):
+class _Model(BaseModel):
+    # Unknown fields are dropped; instances are immutable once built
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+
+class ChatRequest(_Model):
     message: str
     user_id: str
     session_id: Optional[str] = None
 
 
-class ChatResponse(BaseModel):
+class ChatResponse(_Model):
     response: str
     sessionId: str
     title: Optional[str] = None
@@ -115,18 +174,18 @@ class ChatResponse(BaseModel):
 # ---------------------------------------------------------
 # Auth Models
 # ---------------------------------------------------------
-class GoogleAuthRequest(BaseModel):
+class GoogleAuthRequest(_Model):
     token: str
 
 
-class EmailAuthRequest(BaseModel):
+class EmailAuthRequest(_Model):
     email: str
     password: Optional[str] = None
     name: Optional[str] = None  # User's full name (for signup)
     mode: Optional[str] = None  # 'signin' or 'signup'
 
 
-class AuthResponse(BaseModel):
+class AuthResponse(_Model):
     user_id: str
     name: str
     avatar: Optional[str] = None
@@ -135,7 +194,7 @@ class AuthResponse(BaseModel):
     message: Optional[str] = None
 
 
-class ProfileResponse(BaseModel):
+class ProfileResponse(_Model):
     user_id: str
     name: str
     email: Optional[str] = None
@@ -145,7 +204,7 @@ class ProfileResponse(BaseModel):
     last_login: Optional[str] = None
 
 
-class ProfileUpdateRequest(BaseModel):
+class ProfileUpdateRequest(_Model):
     user_id: str
     name: Optional[str] = None
     old_password: Optional[str] = None
@@ -165,26 +224,120 @@ INDEX = None
 DOCS = None
 
 
-# Helper: call retriever safely regardless of signature
+# Helper: call retriever safely regardless of signature.
+# The signature can't change at runtime, so the call form is picked once at import;
+# MODEL/INDEX/DOCS are still read at call time since they're set on startup.
+def _build_retriever_shim(arity: int):
+    if arity == 1:
+        return lambda query: retrieve_relevant_docs(query)
+    elif arity == 2:
+        return lambda query: retrieve_relevant_docs(query, MODEL)
+    elif arity == 3:
+        return lambda query: retrieve_relevant_docs(query, MODEL, INDEX)
+    else:
+        # fallback: pass all
+        return lambda query: retrieve_relevant_docs(query, MODEL, INDEX, DOCS)
+
+
+_RETRIEVER_ARITY = len(inspect.signature(retrieve_relevant_docs).parameters)
+_RETRIEVER = _build_retriever_shim(_RETRIEVER_ARITY)
+
+
 def _call_retriever(query: str):
     try:
-        sig = inspect.signature(retrieve_relevant_docs)
-        params = len(sig.parameters)
-        if params == 1:
-            return retrieve_relevant_docs(query)
-        elif params == 2:
-            return retrieve_relevant_docs(query, MODEL)
-        elif params == 3:
-            return retrieve_relevant_docs(query, MODEL, INDEX)
-        else:
-            # fallback: pass all
-            return retrieve_relevant_docs(query, MODEL, INDEX, DOCS)
+        return _RETRIEVER(query)
     except Exception as e:
         # if anything fails, return empty list
         print("retriever call failed:", e)
         return []
 
 
+def _issue_session_token(user_id: str) -> str:
+    """Signed HS256 JWT; verifiable later with jwt.decode, no server-side storage needed."""
+    now = int(time.time())
+    return jwt.encode({"sub": user_id, "iat": now, "exp": now + SESSION_TTL_SECONDS}, JWT_SECRET, algorithm="HS256")
+
+
+# Google's signing certs change rarely (keys rotate over days), so fetch them at most
+# once per window instead of on every login
+_GOOGLE_CERTS_TTL_S = 6 * 3600
+# A token that fails verification may be signed with a newly published key, which
+# justifies refetching early; but anyone can send such a token, so at most once a minute
+_GOOGLE_CERTS_MIN_REFRESH_S = 60
+
+
+class _CachedGetRequest:
+    """
+    google-auth transport that caches successful GET responses (the cert set
+    verify_oauth2_token downloads) for _GOOGLE_CERTS_TTL_S.
+    """
+
+    def __init__(self, http):
+        self._http = http
+        self._cache: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._last_forced = float("-inf")
+
+    def __call__(self, url, method="GET", **kwargs):
+        if method != "GET":
+            return self._http(url, method=method, **kwargs)
+        now = time.monotonic()
+        with self._lock:
+            hit = self._cache.get(url)
+        if hit is not None and now - hit[0] < _GOOGLE_CERTS_TTL_S:
+            return hit[1]
+        response = self._http(url, method=method, **kwargs)
+        if response.status == 200:
+            with self._lock:
+                self._cache[url] = (now, response)
+        return response
+
+    def force_refresh(self) -> bool:
+        """Drop cached responses unless that was done within the last minute; True if dropped."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_forced < _GOOGLE_CERTS_MIN_REFRESH_S:
+                return False
+            self._last_forced = now
+            self._cache.clear()
+        return True
+
+
+_GOOGLE_REQ = _CachedGetRequest(_GOOGLE_HTTP) if GOOGLE_AUTH_AVAILABLE else None
+
+
+def _verify_google_token(token: str) -> Dict[str, Any]:
+    """id_token.verify_oauth2_token against the cached certs (checks signature, expiry, audience, issuer)."""
+    try:
+        return id_token.verify_oauth2_token(token, _GOOGLE_REQ, GOOGLE_CLIENT_ID)
+    except ValueError:
+        # possibly signed with a key published since our last fetch: refetch (throttled) and retry
+        if not _GOOGLE_REQ.force_refresh():
+            raise
+        return id_token.verify_oauth2_token(token, _GOOGLE_REQ, GOOGLE_CLIENT_ID)
+
+
+def _email_user_id(email_lower: str) -> str:
+    return "email_" + hashlib.blake2b(email_lower.encode(), digest_size=6).hexdigest()
+
+
+def _legacy_email_user_id(email_lower: str) -> str:
+    # ids of accounts created before the switch to blake2b
+    return f"email_{hashlib.md5(email_lower.encode()).hexdigest()[:12]}"
+
+
+def _find_email_user(email_lower: str):
+    """Return (user_id, user) for an email account; user is None if it doesn't exist."""
+    user_id = _email_user_id(email_lower)
+    user = get_user_by_id(user_id)
+    if user is None:
+        legacy_id = _legacy_email_user_id(email_lower)
+        legacy = get_user_by_id(legacy_id)
+        if legacy is not None:
+            return legacy_id, legacy
+    return user_id, user
+
+
 # ---------------------------------------------------------
 # Routes
 # ---------------------------------------------------------
@@ -197,7 +350,7 @@ def health():
 # Auth Endpoints
 # ---------------------------------------------------------
 @app.post("/auth/google", response_model=AuthResponse)
-def auth_google(req: GoogleAuthRequest):
+async def auth_google(req: GoogleAuthRequest):
     """
     Handle Google OAuth token verification - Production Grade.
     
@@ -221,17 +374,13 @@ def auth_google(req: GoogleAuthRequest):
         if GOOGLE_AUTH_AVAILABLE and GOOGLE_CLIENT_ID:
             try:
                 verification_method = "google-auth (server verification)"
-                print(f"🔍 Attempting Google server verification with Client ID: {GOOGLE_CLIENT_ID[:20]}...")
+                log.debug("🔍 Attempting Google server verification with Client ID: %.20s...", GOOGLE_CLIENT_ID)
                 
                 # Verify token signature and claims with Google's servers
-                idinfo = id_token.verify_oauth2_token(
-                    token,
-                    google_requests.Request(),
-                    GOOGLE_CLIENT_ID
-                )
+                idinfo = await asyncio.to_thread(_verify_google_token, token)
                 
                 # Additional checks
-                if idinfo.get('aud') != GOOGLE_CLIENT_ID:
+                if not hmac.compare_digest(str(idinfo.get('aud', '')).encode(), GOOGLE_CLIENT_ID.encode()):
                     raise ValueError("Token audience doesn't match")
                 
                 # Check token expiration
@@ -242,35 +391,29 @@ def auth_google(req: GoogleAuthRequest):
                 if current_time > expires_in:
                     raise ValueError("Token has expired")
                 
-                print(f"✅ Token verified with Google servers")
+                log.debug("✅ Token verified with Google servers")
                 
             except Exception as e:
-                print(f"⚠️  Google server verification failed: {e}")
-                print(f"📋 Falling back to manual token decode...")
+                log.warning("⚠️  Google server verification failed: %s. Falling back to manual token decode", e)
                 verification_method = "manual decode (fallback)"
                 idinfo = None  # Reset to use fallback
         
         # Fallback: decode without verification (development only)
         if not idinfo:
             if not GOOGLE_AUTH_AVAILABLE:
-                print("⚠️  google-auth library not available. Using manual decode (DEV ONLY)")
+                log.warning("⚠️  google-auth library not available. Using manual decode (DEV ONLY)")
             elif not GOOGLE_CLIENT_ID:
-                print("⚠️  GOOGLE_CLIENT_ID not set. Using manual decode (DEV ONLY)")
+                log.warning("⚠️  GOOGLE_CLIENT_ID not set. Using manual decode (DEV ONLY)")
             
             # Decode JWT token manually (Google JWT format: header.payload.signature)
-            parts = token.split('.')
+            parts = token.split('.', 2)
             if len(parts) != 3:
                 raise ValueError("Invalid token format")
             
-            # Decode payload (add padding if needed)
-            payload = parts[1]
-            padding = 4 - len(payload) % 4
-            if padding != 4:
-                payload += '=' * padding
-            
+            # Decode payload; surplus '=' padding is ignored by the decoder
             try:
-                idinfo = json.loads(base64.urlsafe_b64decode(payload))
-                print(f"✅ Token decoded manually (fallback): {list(idinfo.keys())}")
+                idinfo = orjson.loads(base64.urlsafe_b64decode(parts[1] + "=="))
+                log.debug("✅ Token decoded manually (fallback): %s", idinfo.keys())
             except Exception as e:
                 raise ValueError(f"Failed to decode token: {e}")
         
@@ -282,17 +425,10 @@ def auth_google(req: GoogleAuthRequest):
         given_name = idinfo.get('given_name', '')  # First name from Google
         family_name = idinfo.get('family_name', '')  # Last name from Google
         
-        print(f"\n" + "="*60)
-        print(f"🔍 GOOGLE TOKEN DEBUG INFO:")
-        print(f"="*60)
-        print(f"Raw token data extracted:")
-        print(f"  - name: '{name}' (type: {type(name).__name__}, len: {len(str(name))})")
-        print(f"  - given_name: '{given_name}'")
-        print(f"  - family_name: '{family_name}'")
-        print(f"  - email: '{email}'")
-        print(f"  - sub: '{user_id_from_google}'")
-        print(f"  - picture: '{avatar}'")
-        print(f"All token keys: {list(idinfo.keys())}")
+        log.debug(
+            "🔍 Google token: name=%r given_name=%r family_name=%r email=%r sub=%r picture=%r keys=%s",
+            name, given_name, family_name, email, user_id_from_google, avatar, idinfo.keys(),
+        )
         
         if not user_id_from_google:
             raise ValueError("No user ID in token")
@@ -303,41 +439,32 @@ def auth_google(req: GoogleAuthRequest):
         if not name or name.strip() == "":
             if given_name or family_name:
                 final_name = f"{given_name} {family_name}".strip()
-                print(f"✅ Using given_name + family_name: {final_name}")
+                log.debug("✅ Using given_name + family_name: %s", final_name)
             elif email:
                 final_name = email.split("@")[0]
-                print(f"⚠️  No name in token, using email prefix: {final_name}")
+                log.debug("⚠️  No name in token, using email prefix: %s", final_name)
             else:
                 final_name = "Google User"
-                print(f"⚠️  No name data available, using default: {final_name}")
+                log.debug("⚠️  No name data available, using default: %s", final_name)
         else:
-            print(f"✅ Using full name from token: {final_name}")
+            log.debug("✅ Using full name from token: %s", final_name)
         
         # Create consistent user_id based on Google's sub
         user_id = f"google_{user_id_from_google}"
 
         # Determine whether this is a first-time signup or a signin
         # Determine if an account already exists by email or id
-        prior = get_user_by_email(email) or get_user_by_id(user_id)
+        prior = await asyncio.to_thread(lambda: get_user_by_email(email) or get_user_by_id(user_id))
         existed_before = prior is not None
 
         # Upsert Google user; may merge into an existing email user and return its id
-        final_user_id = upsert_google_user(user_id, email, final_name, avatar, verified=True)
-        update_last_login(final_user_id)
+        final_user_id = await asyncio.to_thread(upsert_google_user, user_id, email, final_name, avatar, verified=True)
+        await asyncio.to_thread(update_last_login, final_user_id)
         
         # Generate secure session token
-        session_token = hashlib.sha256(
-            f"{user_id}{time.time()}{JWT_SECRET}".encode()
-        ).hexdigest()
+        session_token = _issue_session_token(final_user_id)
         
-        print(f"\n📤 RETURNING TO FRONTEND:")
-        print(f"  - user_id: {final_user_id}")
-        print(f"  - name: {final_name}")
-        print(f"  - avatar: {avatar}")
-        print(f"  - token: {session_token[:20]}...")
-        print(f"="*60 + "\n")
-        
-        print(f"✅ Google OAuth success ({verification_method}): {final_user_id} ({final_name}) - {email}")
+        log.info("✅ Google OAuth success (%s): %s (%s) - %s", verification_method, final_user_id, final_name, email)
         
         # Return user info (matches what production apps return)
         return AuthResponse(
@@ -350,18 +477,16 @@ def auth_google(req: GoogleAuthRequest):
         )
         
     except ValueError as e:
-        print(f"❌ Google auth validation error: {e}")
+        log.info("❌ Google auth validation error: %s", e)
         raise HTTPException(status_code=401, detail=str(e))
     except Exception as e:
-        print(f"❌ Google auth error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Google auth error: %s", e)
         raise HTTPException(status_code=500, detail="Google authentication failed")
 
 
 @app.get("/profile", response_model=ProfileResponse)
-def get_profile(user_id: str):
-    user = get_user_by_id(user_id)
+async def get_profile(user_id: str):
+    user = await asyncio.to_thread(get_user_by_id, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return ProfileResponse(
@@ -376,8 +501,8 @@ def get_profile(user_id: str):
 
 
 @app.put("/profile", response_model=ProfileResponse)
-def update_profile(req: ProfileUpdateRequest):
-    user = get_user_by_id(req.user_id)
+async def update_profile(req: ProfileUpdateRequest):
+    user = await asyncio.to_thread(get_user_by_id, req.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -386,7 +511,7 @@ def update_profile(req: ProfileUpdateRequest):
         new_name = req.name.strip()
         if not new_name:
             raise HTTPException(status_code=400, detail="Name cannot be empty")
-        update_user_name(req.user_id, new_name)
+        await asyncio.to_thread(update_user_name, req.user_id, new_name)
 
     # Handle password change only for email provider
     if req.old_password or req.new_password:
@@ -397,16 +522,16 @@ def update_profile(req: ProfileUpdateRequest):
         if len(req.new_password) < 6:
             raise HTTPException(status_code=400, detail="New password must be at least 6 characters")
 
-        stored_hash = get_password_hash(req.user_id)
+        stored_hash = await asyncio.to_thread(get_password_hash, req.user_id)
         if not stored_hash:
             raise HTTPException(status_code=400, detail="No password set for this account")
-        if not pwd_context.verify(req.old_password, stored_hash):
+        if not await _run_hasher(pwd_context.verify, req.old_password, stored_hash):
             raise HTTPException(status_code=400, detail="Old password is incorrect")
 
-        new_hash = pwd_context.hash(req.new_password)
-        set_password_hash(req.user_id, new_hash)
+        new_hash = await _run_hasher(pwd_context.hash, req.new_password)
+        await asyncio.to_thread(set_password_hash, req.user_id, new_hash)
 
-    updated = get_user_by_id(req.user_id)
+    updated = await asyncio.to_thread(get_user_by_id, req.user_id)
     return ProfileResponse(
         user_id=updated["id"],
         name=updated.get("name") or updated.get("email") or "User",
@@ -419,7 +544,7 @@ def update_profile(req: ProfileUpdateRequest):
 
 
 @app.post("/auth/email", response_model=AuthResponse)
-def auth_email(req: EmailAuthRequest):
+async def auth_email(req: EmailAuthRequest):
     """
     Handle email-based authentication with password.
     Requires password for both signup and login.
@@ -435,8 +560,8 @@ def auth_email(req: EmailAuthRequest):
         # Normalize email
         email_lower = req.email.lower().strip()
         
-        # Create consistent user_id from email
-        user_id = f"email_{hashlib.md5(email_lower.encode()).hexdigest()[:12]}"
+        # Create consistent user_id from email (and load the account if it exists)
+        user_id, existing = await asyncio.to_thread(_find_email_user, email_lower)
         
         # Use provided name or extract from email
         name = req.name.strip() if req.name and req.name.strip() else email_lower.split("@")[0]
@@ -446,64 +571,45 @@ def auth_email(req: EmailAuthRequest):
         if intended_mode not in ("signin", "signup"):
             intended_mode = "signin"
         
-        print(f"\n" + "="*60)
-        print(f"📧 EMAIL AUTH ATTEMPT:")
-        print(f"="*60)
-        print(f"   Email: {email_lower}")
-        print(f"   User ID: {user_id}")
-        print(f"   Password length: {len(req.password)} chars")
-        print(f"   Provided name (from request): '{req.name}'")
-        print(f"   Final name (to be stored): '{name}'")
+        log.debug("📧 Email auth attempt: email=%s user_id=%s provided_name=%r name=%r", email_lower, user_id, req.name, name)
         
         # Check if user already exists
-        if get_user_by_id(user_id):
-            print(f"   Status: EXISTING USER (login)")
-            existing = get_user_by_id(user_id) or {}
-            print(f"   Stored name in DB: '{existing.get('name')}'")
+        if existing:
+            log.debug("   Existing user (login), stored name: %r", existing.get("name"))
             # If client attempted signup but user exists, block with clear error
             if intended_mode == "signup":
                 raise ValueError("Account already exists. Please sign in.")
 
             # User exists - must verify password
-            stored_hash = get_password_hash(user_id)
+            stored_hash = await asyncio.to_thread(get_password_hash, user_id)
             
             if not stored_hash:
-                print(f"   ❌ ERROR: User exists but no password hash found!")
+                log.error("❌ User %s exists but no password hash found", user_id)
                 raise ValueError("User account corrupted - password not found")
             
             # Verify the password against stored hash
-            password_matches = pwd_context.verify(req.password, stored_hash)
-            print(f"   Password check: {'✅ MATCH' if password_matches else '❌ NO MATCH'}")
-            
+            password_matches = await _run_hasher(pwd_context.verify, req.password, stored_hash)
             if not password_matches:
                 raise ValueError("Invalid email or password")
             
-            print(f"✅ Email login successful: {user_id} ({email_lower})")
-            update_last_login(user_id)
+            log.info("✅ Email login successful: %s (%s)", user_id, email_lower)
+            await asyncio.to_thread(update_last_login, user_id)
         else:
-            print(f"   Status: NEW USER (signup)")
+            log.debug("   New user (signup)")
             # If client attempted signin but account doesn't exist, block with clear error
             if intended_mode == "signin":
                 raise ValueError("Account not found. Please sign up.")
             # New user - hash and store password
-            hashed_password = pwd_context.hash(req.password)
-            create_email_user(user_id, email_lower, name, hashed_password)
-            print(f"✅ Email signup successful: {user_id} ({email_lower})")
-            print(f"   Profile name stored: '{name}'")
-            print(f"   Password hashed and stored")
+            hashed_password = await _run_hasher(pwd_context.hash, req.password)
+            await asyncio.to_thread(create_email_user, user_id, email_lower, name, hashed_password)
+            log.info("✅ Email signup successful: %s (%s), name %r", user_id, email_lower, name)
         
         # Generate session token
-        session_token = hashlib.sha256(f"{user_id}{time.time()}{JWT_SECRET}".encode()).hexdigest()
+        session_token = _issue_session_token(user_id)
         
         # Verify what we're returning
-        stored_user = get_user_by_id(user_id) or {"name": name, "email": email_lower}
-        print(f"\n📤 RETURNING TO FRONTEND:")
-        print(f"  - user_id: {user_id}")
-        print(f"  - name: {stored_user['name']}")
-        print(f"  - email: {stored_user['email']}")
-        print(f"  - token: {session_token[:20]}...")
-        print(f"="*60 + "\n")
-        
+        stored_user = await asyncio.to_thread(get_user_by_id, user_id) or {"name": name, "email": email_lower}
+
         # Compose status/message based on intended flow
         status = "signin" if intended_mode == "signin" else "signup"
         message = "Signed in successfully" if status == "signin" else "Account created successfully"
@@ -517,17 +623,15 @@ def auth_email(req: EmailAuthRequest):
             message=message,
         )
     except ValueError as e:
-        print(f"❌ Email auth validation error: {e}")
+        log.info("❌ Email auth validation error: %s", e)
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        print(f"❌ Email auth failed: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("❌ Email auth failed: %s", e)
         raise HTTPException(status_code=500, detail="Email authentication failed")
 
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest):
     """
     Handles chat: new session or existing one.
     Retrieves context using FAISS, generates LLM answer (structured),
@@ -540,40 +644,28 @@ def chat(req: ChatRequest):
     # If no session → create new one
     new_session = False
     if session_id is None:
-        session_id = db_create_session(user_id)
+        session_id = await asyncio.to_thread(db_create_session, user_id)
         new_session = True
-
-    # Store user message
-    db_add_message(session_id, "user", message)
+    elif not await asyncio.to_thread(session_exists, session_id):
+        # check before spending retrieval/generation on a turn we couldn't save
+        raise HTTPException(status_code=404, detail="Session not found")
 
     # ---- RAG Retrieval ----
     ret_start = time.time()
-    retrieved_docs = _call_retriever(message) or []
+    retrieved_docs = await asyncio.to_thread(_call_retriever, message) or []
     ret_dur = time.time() - ret_start
     print(f"RAG retrieval took {ret_dur:.3f}s")
 
     # ---- LLM Response (structured) ----
     gen_start = time.time()
-    result = generate_legal_answer(message, retrieved_docs)
+    result = await asyncio.to_thread(generate_legal_answer, message, retrieved_docs)
     gen_dur = time.time() - gen_start
     print(f"LLM generation took {gen_dur:.3f}s")
 
-    # update simple in-memory stats (best-effort)
-    try:
-        _STATS["requests"] = (_STATS.get("requests") or 0) + 1
-        _STATS["last_retrieval_s"] = ret_dur
-        _STATS["last_generation_s"] = gen_dur
-        # running averages
-        if _STATS.get("avg_retrieval_s") is None:
-            _STATS["avg_retrieval_s"] = ret_dur
-        else:
-            _STATS["avg_retrieval_s"] = (_STATS["avg_retrieval_s"] * (_STATS["requests"] - 1) + ret_dur) / _STATS["requests"]
-        if _STATS.get("avg_generation_s") is None:
-            _STATS["avg_generation_s"] = gen_dur
-        else:
-            _STATS["avg_generation_s"] = (_STATS["avg_generation_s"] * (_STATS["requests"] - 1) + gen_dur) / _STATS["requests"]
-    except Exception:
-        pass
+    # update simple in-memory stats
+    _STATS["requests"] = next(_REQUEST_COUNTER)
+    _RETRIEVAL_S.append(ret_dur)
+    _GENERATION_S.append(gen_dur)
 
     # result expected to be dict: {"markdown": str, "metadata": {...}}
     if isinstance(result, dict):
@@ -584,24 +676,33 @@ def chat(req: ChatRequest):
         answer_markdown = str(result)
         metadata = None
 
+    # Automatically set session title based on first user query
+    title = None
+    if new_session:
+        title = message[:40] + "..." if len(message) > 40 else message
+
+    # Store the user/assistant pair (and the new session's title) in one transaction;
+    # finalize=True also persists any transient messages parked during the turn.
     # ensure we store a string in DB (avoid sqlite binding problems)
     try:
-        db_add_message(session_id, "assistant", str(answer_markdown))
+        await asyncio.to_thread(
+            db_add_messages,
+            session_id,
+            [("user", message), ("assistant", str(answer_markdown))],
+            title,
+            finalize=True,
+        )
+    except sqlite3.IntegrityError:
+        # session deleted while the answer was being generated (foreign key violation)
+        raise HTTPException(status_code=404, detail="Session not found")
     except Exception as e:
         # if DB insertion fails, print and continue (we don't want to crash the endpoint)
-        print("Failed to save assistant message:", e)
+        print("Failed to save chat messages:", e)
 
-    # Automatically set session title based on first user query
-    if new_session:
-        try:
-            title = message[:40] + "..." if len(message) > 40 else message
-            update_session_title(session_id, title)
-        except Exception:
-            pass
-
-    # Return chat response (markdown string for frontend)
-    return ChatResponse(
-        response=answer_markdown,
+    # Return chat response (markdown string for frontend); every field is
+    # already the right type, so skip re-validating the model
+    return ChatResponse.model_construct(
+        response=str(answer_markdown),
         sessionId=session_id,
         title=message[:40],
         metadata=metadata
@@ -615,22 +716,30 @@ def history(user_id: str):
 
 
 @app.get("/admin/stats")
-def admin_stats():
-    # return a copy to avoid accidental mutation
-    return {k: (_STATS.get(k) if _STATS.get(k) is not None else None) for k in _STATS}
+async def admin_stats():
+    # async so it runs on the event loop with chat(), which appends to the deques;
+    # averages are over the last _STATS_WINDOW requests
+    return {
+        "requests": _STATS["requests"],
+        "last_retrieval_s": _RETRIEVAL_S[-1] if _RETRIEVAL_S else None,
+        "last_generation_s": _GENERATION_S[-1] if _GENERATION_S else None,
+        "avg_retrieval_s": statistics.fmean(_RETRIEVAL_S) if _RETRIEVAL_S else None,
+        "avg_generation_s": statistics.fmean(_GENERATION_S) if _GENERATION_S else None,
+    }
 
 
 @app.get("/chat/{session_id}")
 def get_chat_messages(session_id: str, user_id: str):
-    msgs = get_messages(session_id)
+    msgs = get_messages_raw(session_id)
     if msgs is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
     formatted = [
-        {"role": m["role"], "content": m["content"], "timestamp": m["timestamp"]}
-        for m in msgs
+        {"role": role, "content": content, "timestamp": timestamp}
+        for role, content, timestamp in msgs
     ]
-    return {"messages": formatted}
+    # already plain dicts of primitives: skip jsonable_encoder
+    return ORJSONResponse({"messages": formatted})
 
 
 @app.delete("/chat/{session_id}")
@@ -648,23 +757,49 @@ def startup_load_model():
     try:
         print("⏳ Loading model and index...")
         MODEL, INDEX, DOCS = loader.load_model_data()
+        # Casefold/index the docs for the text fallback now rather than on its first query
+        prepare_text_index(DOCS)
         print("✅ Model and index loaded on startup.")
     except Exception as e:
         print(f"⚠️ Failed to load model/index on startup: {e}")
-        import traceback
         traceback.print_exc()
         # Don't crash - auth endpoints work without model
         MODEL, INDEX, DOCS = None, None, None
 
 
+async def _periodic_db_optimize():
+    # Long-lived connections never close, so PRAGMA optimize is run on a timer
+    while True:
+        await asyncio.sleep(DB_OPTIMIZE_INTERVAL_S)
+        try:
+            await asyncio.to_thread(db_optimize)
+        except Exception as e:
+            log.warning("PRAGMA optimize failed: %s", e)
+
+
+@app.on_event("startup")
+async def startup_db_optimize():
+    # keep a reference so the task is not garbage-collected
+    app.state.db_optimize_task = asyncio.create_task(_periodic_db_optimize())
+
+
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="127.0.0.1", port=5000, reload=True)
+    if ENVIRONMENT == "development":
+        uvicorn.run("app:app", host="127.0.0.1", port=5000, reload=True)
+    else:
+        # uvloop + httptools come with uvicorn[standard]; 2n+1 worker processes
+        # unless WEB_CONCURRENCY says otherwise
+        workers = int(os.getenv("WEB_CONCURRENCY", str(2 * (os.cpu_count() or 1) + 1)))
+        uvicorn.run("app:app", host="127.0.0.1", port=5000, loop="uvloop", http="httptools", workers=workers)
 
 
 # Backend shell commands:
 # D:/Projects/lexai/.venv/Scripts/Activate.ps1
 # cd backend
 # uvicorn app:app --reload --host 127.0.0.1 --port 5000
+#
+# production (Linux):
+# gunicorn -k uvicorn.workers.UvicornWorker -w $((2 * $(nproc) + 1)) -b 127.0.0.1:5000 app:app
 
 # frontend dev server:
 # cd frontend
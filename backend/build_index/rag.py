@@ -1,7 +1,9 @@
 # backend/build_index/rag.py
 import os
-import json
-import pickle
+import msgpack
+import orjson
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 import faiss
 
@@ -9,8 +11,18 @@ import faiss
 # Config
 # ------------------------------
 DATA_FILE = "formatted_ipc_chat.jsonl"
-INDEX_FILE = "../ipc_data.pkl"  # save into backend root
+DOCS_FILE = "../ipc_data.docs.mp"  # docs/queries (msgpack), save into backend root
+FAISS_FILE = "../ipc_data.faiss"  # native FAISS index, save into backend root
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+ENCODE_BATCH_SIZE = 256
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+# OPQ rotation + IVF (HNSW coarse quantizer) + 32-byte PQ codes, searched by
+# inner product on L2-normalized vectors (= cosine similarity).
+FAISS_FACTORY = "OPQ32_64,IVF4096_HNSW32,PQ32"
+# IVF4096/PQ training needs ~39 points per centroid; smaller corpora use an
+# exact inner-product index instead.
+FAISS_MIN_TRAIN = 4096 * 39
 
 # ------------------------------
 # Load dataset
@@ -19,37 +31,63 @@ def load_dataset(file_path=DATA_FILE):
     if not os.path.exists(file_path):
         raise FileNotFoundError(f"{file_path} not found!")
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-
-    # Separate docs and queries
-    docs = [json.loads(line)["content"] for line in lines if json.loads(line)["role"] == "assistant"]
-    queries = [json.loads(line)["content"] for line in lines if json.loads(line)["role"] == "user"]
+    # Separate docs and queries, parsing each line once while streaming
+    docs, queries = [], []
+    with open(file_path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            obj = orjson.loads(line)
+            role = obj["role"]
+            if role == "assistant":
+                docs.append(obj["content"])
+            elif role == "user":
+                queries.append(obj["content"])
 
     return docs, queries
 
+# ------------------------------
+# Encode docs
+# ------------------------------
+def encode_docs(docs, model):
+    kwargs = dict(
+        batch_size=ENCODE_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=True,
+    )
+    if DEVICE == "cuda":
+        # fp16 forward pass on GPU; halves activation memory
+        with torch.autocast("cuda", dtype=torch.float16):
+            embeddings = model.encode(docs, **kwargs)
+    else:
+        embeddings = model.encode(docs, **kwargs)
+    # FAISS only accepts float32
+    return np.ascontiguousarray(embeddings, dtype="float32")
+
 # ------------------------------
 # Build FAISS index
 # ------------------------------
-def build_faiss_index(docs, model):
-    embeddings = model.encode(docs)
+def build_faiss_index(embeddings):
     dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
+    if len(embeddings) >= FAISS_MIN_TRAIN:
+        index = faiss.index_factory(dim, FAISS_FACTORY, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+    else:
+        index = faiss.IndexFlatIP(dim)
     index.add(embeddings)
     return index
 
 # ------------------------------
 # Save data
 # ------------------------------
-def save_index(model, index, docs, queries, file_path=INDEX_FILE):
+def save_index(index, docs, queries, file_path=DOCS_FILE, faiss_path=FAISS_FILE):
+    # FAISS' own format can be memory-mapped at load time; the corpus is plain
+    # msgpack so loading it never executes unpickling code
+    faiss.write_index(index, faiss_path)
     with open(file_path, "wb") as f:
-        pickle.dump({
-            "model": None,  # avoid serializing model object itself
-            "index": index,
-            "docs": docs,
-            "queries": queries
-        }, f)
-    print(f"RAG index saved to {file_path} ✅")
+        f.write(msgpack.packb({"docs": docs, "queries": queries}))
+    print(f"RAG index saved to {faiss_path} + {file_path} ✅")
 
 # ------------------------------
 # Main
@@ -58,14 +96,21 @@ def main():
     print("Loading dataset...")
     docs, queries = load_dataset()
 
-    print("Loading embedding model...")
-    model = SentenceTransformer(EMBEDDING_MODEL)
+    print(f"Loading embedding model on {DEVICE}...")
+    model = SentenceTransformer(EMBEDDING_MODEL, device=DEVICE)
+
+    print("Encoding docs...")
+    embeddings = encode_docs(docs, model)
+    # release the model (and its GPU memory) before training/saving the index
+    del model
+    if DEVICE == "cuda":
+        torch.cuda.empty_cache()
 
     print("Building FAISS index...")
-    index = build_faiss_index(docs, model)
+    index = build_faiss_index(embeddings)
 
     print("Saving index...")
-    save_index(model, index, docs, queries)
+    save_index(index, docs, queries)
     print("RAG Index created successfully ✅")
 
 # ------------------------------
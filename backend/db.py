@@ -5,10 +5,18 @@ Simple SQLite persistence for LEXAI.
 Provides:
 - create_session(user_id) -> session_id (str)
 - add_message(session_id, role, content, metadata=None)
+- add_messages(session_id, [(role, content[, metadata]), ...], title=None, finalize=False)
 - get_messages(session_id) -> list[dict]
+- finalize_session(session_id) -> int (persist this process's pending transient messages)
+- get_messages_raw(session_id) -> list[(role, content, timestamp)]
+- iter_messages(session_id, after_id=0, limit=None) -> iterator of dicts (with id)
+- get_recent_messages(session_id, n) -> list[dict] (last n, oldest first)
 - get_sessions_for_user(user_id) -> list[dict]
+- session_exists(session_id) -> bool
 - delete_session(session_id) -> bool
 - update_session_title(session_id, title) -> None
+- optimize() -> None
+- transaction() -> context manager yielding a cursor (one BEGIN IMMEDIATE ... COMMIT)
 
 User persistence:
 - get_user_by_id(user_id) -> Optional[dict]
@@ -23,26 +31,339 @@ User persistence:
 
 import sqlite3
 import uuid
-import json
 import os
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Callable, Iterator, Tuple
+
+import orjson
+from cachetools import TTLCache
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    zstandard = None
+    ZSTD_AVAILABLE = False
 
 DB_PATH = os.path.join(os.path.dirname(__file__), "lexai.db")
 # ensure folder exists
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
+# Read connections are pooled per process; all writes share one connection
+# (SQLite allows a single writer at a time anyway).
+READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", str(os.cpu_count() or 4)))
+# When the sqlite3 module is built serialized (threadsafety == 3, the default
+# on Python 3.11+), one read connection can be shared by every thread and the
+# pool is skipped. DB_SHARED_READER=0 forces the pool.
+SHARED_READER = sqlite3.threadsafety >= 3 and os.getenv("DB_SHARED_READER", "1") == "1"
+# Writes are queued to a single writer thread, which commits everything already
+# queued plus anything arriving within this window (milliseconds) as one
+# transaction. 0 = no waiting: a lone write commits at once, and batches form
+# only from writes queued while the previous commit was running.
+WRITE_BATCH_WINDOW_MS = float(os.getenv("DB_WRITE_BATCH_WINDOW_MS", "0"))
+WRITE_BATCH_MAX = 256
+# How long a caller waits for its queued write to start before giving up (seconds)
+WRITE_TIMEOUT_S = float(os.getenv("DB_WRITE_TIMEOUT", "30"))
+# How often the app should call optimize() (seconds)
+OPTIMIZE_INTERVAL_S = int(os.getenv("DB_OPTIMIZE_INTERVAL", "900"))
+
+# Applied to every connection. WAL lets readers run alongside the writer,
+# synchronous=NORMAL drops the per-commit fsync (still safe in WAL mode),
+# and the larger page cache (64 MB) / mmap keep hot chat history in memory.
+# DB_PATH is always a file, so WAL is safe (it is not for ":memory:").
+# foreign_keys is per-connection and off by default in SQLite.
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+)
+
+# SQL text is kept in constants so every call sends the identical string and
+# hits the connection's prepared-statement cache.
+_SQL_INSERT_SESSION = "INSERT INTO sessions (id, user_id, title, created_at) VALUES (?, ?, ?, ?)"
+_SQL_SET_SESSION_TITLE = "UPDATE sessions SET title = ? WHERE id = ?"
+_SQL_INSERT_MESSAGE = "INSERT INTO messages (session_id, role, content, metadata, timestamp) VALUES (?, ?, ?, ?, ?)"
+_SQL_INSERT_PENDING = "INSERT INTO mem.messages_pending (session_id, role, content, metadata, timestamp) VALUES (?, ?, ?, ?, ?)"
+_SQL_FLUSH_PENDING = (
+    "INSERT INTO messages (session_id, role, content, metadata, timestamp) "
+    "SELECT session_id, role, content, metadata, timestamp FROM mem.messages_pending WHERE session_id = ? ORDER BY id"
+)
+_SQL_DELETE_PENDING = "DELETE FROM mem.messages_pending WHERE session_id = ?"
+_SQL_SELECT_MESSAGES = "SELECT role, content, metadata, timestamp FROM messages WHERE session_id = ? ORDER BY id ASC"
+_SQL_SELECT_MESSAGES_AFTER = "SELECT id, role, content, metadata, timestamp FROM messages WHERE session_id = ? AND id > ? ORDER BY id ASC LIMIT ?"
+_SQL_SELECT_MESSAGES_LAST = "SELECT role, content, metadata, timestamp FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?"
+_SQL_SELECT_MESSAGES_RAW = "SELECT role, content, timestamp FROM messages WHERE session_id = ? ORDER BY id ASC"
+_SQL_SELECT_SESSIONS = "SELECT id, title, created_at FROM sessions WHERE user_id = ? ORDER BY created_at DESC"
+_SQL_DELETE_SESSION = "DELETE FROM sessions WHERE id = ?"
+_SQL_SESSION_EXISTS = "SELECT 1 FROM sessions WHERE id = ?"
+
+_USER_COLS = ("id", "provider", "email", "name", "avatar", "hashed_password", "verified", "created_at", "last_login")
+_SQL_USER_BY_ID = f"SELECT {', '.join(_USER_COLS)} FROM users WHERE id = ?"
+_SQL_USER_BY_EMAIL = f"SELECT {', '.join(_USER_COLS)} FROM users WHERE email = ?"
+_SQL_USER_ID_BY_EMAIL = "SELECT id FROM users WHERE email = ?"
+_SQL_PASSWORD_HASH_BY_ID = "SELECT hashed_password FROM users WHERE id = ?"
+_SQL_INSERT_USER = "INSERT INTO users (id, provider, email, name, avatar, hashed_password, verified, created_at, last_login) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+_SQL_UPDATE_GOOGLE_USER = "UPDATE users SET provider = ?, email = ?, name = ?, avatar = ?, verified = ?, last_login = ? WHERE id = ?"
+_SQL_MERGE_GOOGLE_USER = "UPDATE users SET provider = ?, name = ?, avatar = ?, verified = ?, last_login = ? WHERE id = ?"
+# One-statement Google upsert: an existing id is updated in place (email included),
+# otherwise an existing account with the same email is merged into (email kept),
+# otherwise a new row is inserted. Multiple ON CONFLICT clauses and RETURNING
+# need SQLite >= 3.35.
+_SQL_UPSERT_GOOGLE_USER = (
+    "INSERT INTO users (id, provider, email, name, avatar, hashed_password, verified, created_at, last_login) "
+    "VALUES (?, 'google', ?, ?, ?, NULL, ?, ?, ?) "
+    "ON CONFLICT(id) DO UPDATE SET provider = 'google', email = excluded.email, name = excluded.name, "
+    "avatar = excluded.avatar, verified = excluded.verified, last_login = excluded.last_login "
+    "ON CONFLICT(email) DO UPDATE SET provider = 'google', name = excluded.name, "
+    "avatar = excluded.avatar, verified = excluded.verified, last_login = excluded.last_login "
+    "RETURNING id"
+)
+_HAS_MULTI_UPSERT = sqlite3.sqlite_version_info >= (3, 35, 0)
+_SQL_SET_LAST_LOGIN = "UPDATE users SET last_login = ? WHERE id = ?"
+_SQL_SET_USER_NAME = "UPDATE users SET name = ? WHERE id = ?"
+_SQL_SET_PASSWORD_HASH = "UPDATE users SET hashed_password = ? WHERE id = ?"
+
+
+# (unix second, "YYYY-MM-DDTHH:MM:SS") for the most recent _now_iso() call
+_ts_prefix = (0, "")
+
+
+def _now_iso() -> str:
+    """UTC timestamp as "YYYY-MM-DDTHH:MM:SS.ffffff" (always six fractional digits,
+    so stored timestamps are fixed-width and sort correctly as text).
+
+    The date/time part only has to be formatted once per second; the rest of
+    the calls just append the microseconds.
+    """
+    global _ts_prefix
+    sec, ns = divmod(time.time_ns(), 1_000_000_000)
+    cached = _ts_prefix
+    if cached[0] != sec:
+        cached = (sec, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sec)))
+        _ts_prefix = cached
+    return f"{cached[1]}.{ns // 1000:06d}"
+
 
 def _get_conn():
-    # row_factory for dict-like rows
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
+    # isolation_level=None: autocommit, writes open their transaction explicitly
+    # cached_statements: room for every _SQL_* statement plus the schema
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, cached_statements=256)
+    # rows stay plain tuples; readers unpack them positionally
+    # page_size only takes effect on an empty database, before WAL is enabled;
+    # 8 KB pages keep more of a long message body on a single page
+    if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+        conn.execute("PRAGMA page_size=8192")
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
     return conn
 
 
+# Connections are opened lazily so each worker process gets its own. LIFO so
+# the most recently used connection (warmest page cache) is handed out first.
+_read_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+_read_pool_opened = 0
+_read_pool_lock = threading.Lock()
+_read_conn: Optional[sqlite3.Connection] = None
+_write_conn: Optional[sqlite3.Connection] = None
+_write_lock = threading.Lock()
+
+
+@contextmanager
+def _reader(pooled: bool = False):
+    """
+    Borrow a read connection from the pool (or the shared reader).
+    pooled=True always uses the pool: for cursors held open across yields, whose
+    read transaction would otherwise pin every reader to an old snapshot.
+    """
+    global _read_pool_opened, _read_conn
+    if SHARED_READER and not pooled:
+        if _read_conn is None:
+            with _read_pool_lock:
+                if _read_conn is None:
+                    _read_conn = _get_conn()
+        yield _read_conn.cursor()
+        return
+    try:
+        conn = _read_pool.get_nowait()
+    except queue.Empty:
+        with _read_pool_lock:
+            can_open = _read_pool_opened < READ_POOL_SIZE
+            if can_open:
+                _read_pool_opened += 1
+        if not can_open:
+            conn = _read_pool.get()
+        else:
+            try:
+                conn = _get_conn()
+            except BaseException:
+                # give the slot back, or failed opens would shrink the pool to nothing
+                with _read_pool_lock:
+                    _read_pool_opened -= 1
+                raise
+    try:
+        yield conn.cursor()
+    finally:
+        _read_pool.put(conn)
+
+
+@contextmanager
+def transaction():
+    """Run a write transaction (BEGIN IMMEDIATE ... COMMIT) on the shared write connection.
+
+    Group several writes in one block so they share a single commit (and WAL sync):
+
+        with transaction() as cur:
+            cur.execute(...)
+            cur.executemany(...)
+
+    The public write functions go through the writer thread (see _write), which
+    uses this same lock; don't call them from inside a transaction() block.
+    """
+    with _write_lock:
+        conn = _get_write_conn()
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            yield cur
+            conn.commit()
+        except BaseException:
+            # also covers a failed COMMIT (e.g. SQLITE_BUSY): never leave the shared
+            # write connection inside a transaction, or every later BEGIN fails
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+
+def _get_write_conn() -> sqlite3.Connection:
+    """Open the write connection on first use. Caller must hold _write_lock."""
+    global _write_conn
+    if _write_conn is None:
+        conn = _get_conn()
+        # Transient messages (TRANSIENT_ROLES) are parked in an in-memory
+        # database attached to this connection: no WAL append, no sync.
+        # It is private to this connection, i.e. to this worker process.
+        conn.execute("ATTACH DATABASE ':memory:' AS mem")
+        conn.execute(
+            """
+            CREATE TABLE mem.messages_pending (
+                id INTEGER PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                metadata TEXT,
+                timestamp TEXT NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX mem.idx_pending_session ON messages_pending(session_id)")
+        _write_conn = conn
+    return _write_conn
+
+
+# -------------------------
+# Single writer thread
+# -------------------------
+
+_write_queue: "queue.Queue[Tuple[Callable[[sqlite3.Cursor], Any], Future]]" = queue.Queue()
+_writer_pid: Optional[int] = None
+_writer_start_lock = threading.Lock()
+
+
+def _writer_loop(q: "queue.Queue") -> None:
+    window = WRITE_BATCH_WINDOW_MS / 1000.0
+    while True:
+        batch = [q.get()]
+        deadline = time.monotonic() + window
+        while len(batch) < WRITE_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+            except queue.Empty:
+                break
+        _commit_batch(batch)
+
+
+def _commit_batch(batch) -> None:
+    """Run queued writes in one transaction; a SAVEPOINT isolates each item's failure."""
+    results = []
+    try:
+        with transaction() as cur:
+            for fn, fut in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                cur.execute("SAVEPOINT queued_write")
+                try:
+                    results.append((fut, fn(cur), None))
+                    cur.execute("RELEASE queued_write")
+                except Exception as e:
+                    cur.execute("ROLLBACK TO queued_write")
+                    cur.execute("RELEASE queued_write")
+                    results.append((fut, None, e))
+    except Exception as e:
+        # BEGIN/COMMIT itself failed (e.g. database locked, write connection
+        # couldn't open): nothing in the batch was written. Fail every waiter,
+        # including items that never started, or their callers block forever.
+        for fn, fut in batch:
+            if not fut.done():
+                fut.set_exception(e)
+        return
+    # resolve only after COMMIT so callers never observe uncommitted writes
+    for fut, result, exc in results:
+        if exc is None:
+            fut.set_result(result)
+        else:
+            fut.set_exception(exc)
+
+
+def _write(fn: Callable[[sqlite3.Cursor], Any]) -> Any:
+    """
+    Queue fn(cursor) for the writer thread and wait for its result (or exception).
+    Must not be called while holding transaction(): the writer needs the same lock.
+    """
+    global _writer_pid, _write_queue
+    pid = os.getpid()
+    if _writer_pid != pid:
+        # first write in this process (threads do not survive fork())
+        with _writer_start_lock:
+            if _writer_pid != pid:
+                _write_queue = queue.Queue()
+                threading.Thread(target=_writer_loop, args=(_write_queue,), name="db-writer", daemon=True).start()
+                _writer_pid = pid
+    fut: Future = Future()
+    _write_queue.put((fn, fut))
+    try:
+        return fut.result(timeout=WRITE_TIMEOUT_S)
+    except FuturesTimeoutError:
+        # Not started yet: cancelling guarantees the writer skips it. Once running
+        # it is committed or rolled back with its batch, so wait for that outcome.
+        if fut.cancel():
+            raise TimeoutError(f"database write not started within {WRITE_TIMEOUT_S}s") from None
+        return fut.result()
+
+
+# Stored in PRAGMA user_version once the schema below is in place. Bump it
+# whenever _init_db() changes so existing databases pick up the change.
+SCHEMA_VERSION = 1
+
+
 def _init_db():
+    # Schema setup uses a throwaway connection so nothing is inherited across fork()
     conn = _get_conn()
     cur = conn.cursor()
+    # Up-to-date database (the normal case for every worker start): nothing to do
+    if cur.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+        conn.close()
+        return
+    cur.execute("BEGIN IMMEDIATE")
     # sessions: id, user_id, title, created_at
     cur.execute(
         """
@@ -55,7 +376,7 @@ def _init_db():
         """
     )
 
-    # messages: id (autoinc), session_id FK, role, content (TEXT), metadata(JSON TEXT), timestamp
+    # messages: id (autoinc), session_id FK, role, content (TEXT, or compressed BLOB), metadata(JSON TEXT), timestamp
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS messages (
@@ -70,9 +391,14 @@ def _init_db():
         """
     )
 
-    # index for faster lookups
+    # index for faster lookups. idx_messages_session already ends in the rowid
+    # (= messages.id), so it also serves ORDER BY id without a sort.
     cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id)")
-    cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions(user_id)")
+    # Covering index for get_sessions_for_user: filter, order and all selected
+    # columns come from the index, the table itself is never touched.
+    # It supersedes the old single-column idx_sessions_user.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_created ON sessions(user_id, created_at DESC, id, title)")
+    cur.execute("DROP INDEX IF EXISTS idx_sessions_user")
 
     # users table for authentication persistence
     cur.execute(
@@ -92,10 +418,19 @@ def _init_db():
     )
     cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users(email)")
 
+    cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
+    # gather query planner statistics for the (possibly new) indexes above
+    conn.execute("ANALYZE")
     conn.close()
 
 
+def optimize() -> None:
+    """Run PRAGMA optimize on the write connection (cheap; usually a no-op)."""
+    with _write_lock:
+        _get_write_conn().execute("PRAGMA optimize")
+
+
 # initialize on import
 _init_db()
 
@@ -103,24 +438,19 @@ _init_db()
 def create_session(user_id: str) -> str:
     """Create a new session for user and return session_id."""
     session_id = str(uuid.uuid4())
-    created_at = datetime.utcnow().isoformat()
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO sessions (id, user_id, title, created_at) VALUES (?, ?, ?, ?)",
-        (session_id, user_id, None, created_at),
-    )
-    conn.commit()
-    conn.close()
+    created_at = _now_iso()
+    _write(lambda cur: cur.execute(_SQL_INSERT_SESSION, (session_id, user_id, None, created_at)))
     return session_id
 
 
+def session_exists(session_id: str) -> bool:
+    with _reader() as cur:
+        cur.execute(_SQL_SESSION_EXISTS, (session_id,))
+        return cur.fetchone() is not None
+
+
 def update_session_title(session_id: str, title: str) -> None:
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE sessions SET title = ? WHERE id = ?", (title, session_id))
-    conn.commit()
-    conn.close()
+    _write(lambda cur: cur.execute(_SQL_SET_SESSION_TITLE, (title, session_id)))
 
 
 def add_message(session_id: str, role: str, content: str, metadata: Optional[Dict[str, Any]] = None) -> None:
@@ -129,108 +459,259 @@ def add_message(session_id: str, role: str, content: str, metadata: Optional[Dic
     - content must be a string (we call str(content) to be safe).
     - metadata is serialized to JSON string if provided.
     """
-    if content is None:
-        content = ""
-    content_text = str(content)
-    meta_text = None
-    if metadata is not None:
+    add_messages(session_id, [(role, content, metadata)])
+
+
+def _metadata_to_text(metadata: Optional[Dict[str, Any]]) -> Optional[str]:
+    if metadata is None:
+        return None
+    try:
+        # orjson writes UTF-8 directly (same as ensure_ascii=False)
+        return orjson.dumps(metadata, option=orjson.OPT_NON_STR_KEYS).decode()
+    except Exception:
+        # Fallback: store a simple string
+        return '{"note": "metadata serialization failed"}'
+
+
+# Roles that only matter while a turn is in progress. They are kept in memory
+# until finalize_session() (or add_messages(..., finalize=True), which chat()
+# uses to store each turn) and are not returned by the get_* readers before then.
+# Pending rows are per process: another worker can't see or finalize them, and
+# whatever is still pending when the process exits is lost.
+TRANSIENT_ROLES = frozenset({"tool", "system_debug"})
+
+
+def add_messages(session_id: str, messages: List[Tuple], title: Optional[str] = None,
+                 finalize: bool = False) -> None:
+    """
+    Add several messages in a single transaction (one commit for the whole turn).
+    Each item is (role, content) or (role, content, metadata).
+    If title is given, the session title is updated in the same transaction.
+    Messages with a TRANSIENT_ROLES role go to the in-memory pending table,
+    unless finalize is set: then the session's pending messages are persisted
+    first and everything in this call is stored directly (end of a turn).
+    """
+    timestamp = _now_iso()
+    rows = []
+    pending = []
+    for role, content, *rest in messages:
+        meta_text = _metadata_to_text(rest[0]) if rest else None
+        row = (session_id, role, _encode_content("" if content is None else str(content)), meta_text, timestamp)
+        (pending if role in TRANSIENT_ROLES and not finalize else rows).append(row)
+
+    def _insert(cur):
+        if finalize:
+            # earlier pending rows go first, keeping messages in id order
+            cur.execute(_SQL_FLUSH_PENDING, (session_id,))
+            cur.execute(_SQL_DELETE_PENDING, (session_id,))
+        if rows:
+            cur.executemany(_SQL_INSERT_MESSAGE, rows)
+        if pending:
+            cur.executemany(_SQL_INSERT_PENDING, pending)
+        if title is not None:
+            cur.execute(_SQL_SET_SESSION_TITLE, (title, session_id))
+
+    _write(_insert)
+
+
+def finalize_session(session_id: str) -> int:
+    """Move the session's pending transient messages into messages; returns how many."""
+
+    def _flush(cur):
+        moved = cur.execute(_SQL_FLUSH_PENDING, (session_id,)).rowcount
+        cur.execute(_SQL_DELETE_PENDING, (session_id,))
+        return moved
+
+    return _write(_flush)
+
+
+# Long message bodies are stored compressed as a BLOB with a 1-byte header;
+# short ones stay plain TEXT (as do all rows written before this). The column
+# keeps its TEXT affinity: SQLite never converts BLOB values.
+_COMPRESS_MIN_BYTES = 512
+_HDR_RAW = b"\x00"   # UTF-8, compression did not pay off
+_HDR_ZLIB = b"\x01"
+_HDR_ZSTD = b"\x02"
+_ZSTD_LEVEL = 3
+# zstd contexts must not be shared between threads
+_zstd_local = threading.local()
+
+
+def _zstd_compressor():
+    c = getattr(_zstd_local, "cctx", None)
+    if c is None:
+        c = _zstd_local.cctx = zstandard.ZstdCompressor(level=_ZSTD_LEVEL)
+    return c
+
+
+def _zstd_decompressor():
+    d = getattr(_zstd_local, "dctx", None)
+    if d is None:
+        d = _zstd_local.dctx = zstandard.ZstdDecompressor()
+    return d
+
+
+def _encode_content(text: str):
+    data = text.encode("utf-8")
+    if len(data) <= _COMPRESS_MIN_BYTES:
+        return text
+    if ZSTD_AVAILABLE:
+        packed = _HDR_ZSTD + _zstd_compressor().compress(data)
+    else:
+        packed = _HDR_ZLIB + zlib.compress(data, 6)
+    if len(packed) >= len(data):
+        return _HDR_RAW + data
+    return packed
+
+
+def _decode_content(value) -> str:
+    if not isinstance(value, bytes):
+        return value
+    header, body = value[:1], value[1:]
+    if header == _HDR_ZSTD:
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("message is zstd-compressed; install the zstandard package")
+        body = _zstd_decompressor().decompress(body)
+    elif header == _HDR_ZLIB:
+        body = zlib.decompress(body)
+    return body.decode("utf-8")
+
+
+def _message_dict(role, content, meta_raw, timestamp) -> Dict[str, Any]:
+    meta = None
+    if meta_raw:
         try:
-            meta_text = json.dumps(metadata, ensure_ascii=False)
+            meta = orjson.loads(meta_raw)
         except Exception:
-            # Fallback: store a simple string
-            meta_text = json.dumps({"note": "metadata serialization failed"})
-
-    timestamp = datetime.utcnow().isoformat()
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO messages (session_id, role, content, metadata, timestamp) VALUES (?, ?, ?, ?, ?)",
-        (session_id, role, content_text, meta_text, timestamp),
-    )
-    conn.commit()
-    conn.close()
+            meta = {"raw": meta_raw}
+    return {"role": role, "content": _decode_content(content), "metadata": meta, "timestamp": timestamp}
 
 
 def get_messages(session_id: str) -> List[Dict[str, Any]]:
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT role, content, metadata, timestamp FROM messages WHERE session_id = ? ORDER BY id ASC", (session_id,))
-    rows = cur.fetchall()
-    out = []
-    for r in rows:
-        meta = None
-        if r["metadata"]:
-            try:
-                meta = json.loads(r["metadata"])
-            except Exception:
-                meta = {"raw": r["metadata"]}
-        out.append({"role": r["role"], "content": r["content"], "metadata": meta, "timestamp": r["timestamp"]})
-    conn.close()
-    return out
+    with _reader() as cur:
+        cur.execute(_SQL_SELECT_MESSAGES, (session_id,))
+        rows = cur.fetchall()
+    return [_message_dict(*r) for r in rows]
+
+
+def iter_messages(session_id: str, after_id: int = 0, limit: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Stream messages with id > after_id, oldest first (keyset pagination: pass the
+    last seen "id" back as after_id). Rows are fetched lazily; a pooled read
+    connection (never the shared reader) is held until the iterator is
+    exhausted or closed.
+    """
+    with _reader(pooled=True) as cur:
+        # LIMIT -1 = no limit
+        cur.execute(_SQL_SELECT_MESSAGES_AFTER, (session_id, after_id, -1 if limit is None else limit))
+        for msg_id, role, content, meta_raw, timestamp in cur:
+            msg = _message_dict(role, content, meta_raw, timestamp)
+            msg["id"] = msg_id
+            yield msg
+
+
+def get_recent_messages(session_id: str, n: int) -> List[Dict[str, Any]]:
+    """The last n messages of a session, oldest first. Only n rows are read."""
+    with _reader() as cur:
+        cur.execute(_SQL_SELECT_MESSAGES_LAST, (session_id, n))
+        rows = cur.fetchall()
+    rows.reverse()
+    return [_message_dict(*r) for r in rows]
+
+
+def get_messages_raw(session_id: str) -> List[Tuple[str, str, str]]:
+    """(role, content, timestamp) tuples for callers that don't need metadata or dicts."""
+    with _reader() as cur:
+        cur.execute(_SQL_SELECT_MESSAGES_RAW, (session_id,))
+        rows = cur.fetchall()
+    return [(role, _decode_content(content), timestamp) for role, content, timestamp in rows]
 
 
 def get_sessions_for_user(user_id: str) -> List[Dict[str, Any]]:
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT id, title, created_at FROM sessions WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
-    rows = cur.fetchall()
-    out = []
-    for r in rows:
-        out.append({"id": r["id"], "title": r["title"], "created_at": r["created_at"]})
-    conn.close()
-    return out
+    with _reader() as cur:
+        cur.execute(_SQL_SELECT_SESSIONS, (user_id,))
+        rows = cur.fetchall()
+    return [{"id": sid, "title": title, "created_at": created_at} for sid, title, created_at in rows]
 
 
 def delete_session(session_id: str) -> bool:
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
-    cur.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-    changed = conn.total_changes
-    conn.commit()
-    conn.close()
-    # return True if anything was removed
-    return changed > 0
+    # messages go with it via ON DELETE CASCADE (foreign_keys=ON in _PRAGMAS)
+
+    def _delete(cur):
+        changed = cur.execute(_SQL_DELETE_SESSION, (session_id,)).rowcount
+        cur.execute(_SQL_DELETE_PENDING, (session_id,))
+        return changed
+
+    # return True if the session existed
+    return _write(_delete) > 0
 
 
 # -------------------------
 # Users (Auth) Persistence
 # -------------------------
 
-def _row_to_dict(row) -> Optional[Dict[str, Any]]:
-    if not row:
-        return None
-    return {k: row[k] for k in row.keys()}
+# Short-lived cache for user lookups: a login or profile request reads the same
+# row several times within a second. Users are cached by id; the email cache only
+# maps email -> id, so invalidating the id entry covers both. Writes invalidate
+# only this process's cache, so other workers may serve a profile up to
+# _USER_CACHE_TTL seconds old; get_password_hash therefore never uses it.
+# Misses are not cached (a user may sign up right after a failed lookup).
+_USER_CACHE_TTL = 60
+_user_cache: "TTLCache[str, Dict[str, Any]]" = TTLCache(maxsize=10_000, ttl=_USER_CACHE_TTL)
+_email_cache: "TTLCache[str, str]" = TTLCache(maxsize=10_000, ttl=_USER_CACHE_TTL)
+_user_cache_lock = threading.Lock()
+
+
+def _cache_user(user: Dict[str, Any]) -> None:
+    with _user_cache_lock:
+        _user_cache[user["id"]] = user
+        if user.get("email"):
+            _email_cache[user["email"]] = user["id"]
+
+
+def _invalidate_user(*user_ids: str) -> None:
+    with _user_cache_lock:
+        for user_id in user_ids:
+            _user_cache.pop(user_id, None)
 
 
 def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    return _row_to_dict(row)
+    with _user_cache_lock:
+        user = _user_cache.get(user_id)
+    if user is not None:
+        # callers may mutate the result; never hand out the cached dict
+        return dict(user)
+    with _reader() as cur:
+        cur.execute(_SQL_USER_BY_ID, (user_id,))
+        row = cur.fetchone()
+    user = dict(zip(_USER_COLS, row)) if row else None
+    if user is not None:
+        _cache_user(user)
+        return dict(user)
+    return None
 
 
 def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE email = ?", (email,))
-    row = cur.fetchone()
-    conn.close()
-    return _row_to_dict(row)
+    with _user_cache_lock:
+        user_id = _email_cache.get(email)
+        user = _user_cache.get(user_id) if user_id is not None else None
+    # the email may have moved to another account since it was cached
+    if user is not None and user.get("email") == email:
+        return dict(user)
+    with _reader() as cur:
+        cur.execute(_SQL_USER_BY_EMAIL, (email,))
+        row = cur.fetchone()
+    user = dict(zip(_USER_COLS, row)) if row else None
+    if user is not None:
+        _cache_user(user)
+        return dict(user)
+    return None
 
 
 def create_email_user(user_id: str, email: str, name: str, hashed_password: str) -> None:
-    now = datetime.utcnow().isoformat()
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO users (id, provider, email, name, avatar, hashed_password, verified, created_at, last_login) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (user_id, "email", email, name, None, hashed_password, 1, now, now),
-    )
-    conn.commit()
-    conn.close()
+    now = _now_iso()
+    _write(lambda cur: cur.execute(_SQL_INSERT_USER, (user_id, "email", email, name, None, hashed_password, 1, now, now)))
+    _invalidate_user(user_id)
 
 
 def upsert_google_user(user_id: str, email: str, name: str, avatar: Optional[str], verified: bool = True) -> str:
@@ -238,75 +719,74 @@ def upsert_google_user(user_id: str, email: str, name: str, avatar: Optional[str
 
     Returns the user_id that should be used going forward.
     """
-    now = datetime.utcnow().isoformat()
-    conn = _get_conn()
-    cur = conn.cursor()
-
-    # Try update by id first
-    cur.execute(
-        "UPDATE users SET provider = ?, email = ?, name = ?, avatar = ?, verified = ?, last_login = ? WHERE id = ?",
-        ("google", email, name, avatar, 1 if verified else 0, now, user_id),
-    )
-    if cur.rowcount > 0:
-        conn.commit()
-        conn.close()
+    now = _now_iso()
+
+    def _upsert(cur):
+        if _HAS_MULTI_UPSERT:
+            cur.execute(_SQL_UPSERT_GOOGLE_USER, (user_id, email, name, avatar, 1 if verified else 0, now, now))
+            resolved = cur.fetchone()[0]
+            # step the statement to completion before COMMIT
+            cur.fetchall()
+            return resolved
+        # Older SQLite: try update by id first
+        cur.execute(_SQL_UPDATE_GOOGLE_USER, ("google", email, name, avatar, 1 if verified else 0, now, user_id))
+        if cur.rowcount > 0:
+            return user_id
+        # If not found by id, check if there's an existing account by email
+        cur.execute(_SQL_USER_ID_BY_EMAIL, (email,))
+        row = cur.fetchone()
+        if row:
+            # Merge: update existing user with Google details
+            cur.execute(_SQL_MERGE_GOOGLE_USER, ("google", name, avatar, 1 if verified else 0, now, row[0]))
+            return row[0]
+        # Otherwise, insert new user with provided user_id
+        cur.execute(_SQL_INSERT_USER, (user_id, "google", email, name, avatar, None, 1 if verified else 0, now, now))
         return user_id
 
-    # If not found by id, check if there's an existing account by email
-    cur.execute("SELECT id FROM users WHERE email = ?", (email,))
-    row = cur.fetchone()
-    if row:
-        existing_id = row[0]
-        # Merge: update existing user with Google details
-        cur.execute(
-            "UPDATE users SET provider = ?, name = ?, avatar = ?, verified = ?, last_login = ? WHERE id = ?",
-            ("google", name, avatar, 1 if verified else 0, now, existing_id),
-        )
-        conn.commit()
-        conn.close()
-        return existing_id
-
-    # Otherwise, insert new user with provided user_id
-    cur.execute(
-        "INSERT INTO users (id, provider, email, name, avatar, hashed_password, verified, created_at, last_login) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (user_id, "google", email, name, avatar, None, 1 if verified else 0, now, now),
-    )
-    conn.commit()
-    conn.close()
-    return user_id
+    resolved_id = _write(_upsert)
+    _invalidate_user(user_id, resolved_id)
+    return resolved_id
 
 
 def get_password_hash(user_id: str) -> Optional[str]:
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT hashed_password FROM users WHERE id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    if row and row["hashed_password"]:
-        return row["hashed_password"]
+    # Always read from the DB: a password change in another worker must take
+    # effect immediately, which the per-process user cache can't guarantee
+    with _reader() as cur:
+        cur.execute(_SQL_PASSWORD_HASH_BY_ID, (user_id,))
+        row = cur.fetchone()
+    if row and row[0]:
+        return row[0]
     return None
 
 
+# last_login is informational, so it is written at most once a minute per user.
+# Entries expire on the TTLCache's monotonic clock, which also bounds the size.
+_LAST_LOGIN_DEBOUNCE_S = 60
+_last_login_recent: "TTLCache[str, bool]" = TTLCache(maxsize=10_000, ttl=_LAST_LOGIN_DEBOUNCE_S)
+_last_login_lock = threading.Lock()
+
+
 def update_last_login(user_id: str) -> None:
-    now = datetime.utcnow().isoformat()
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET last_login = ? WHERE id = ?", (now, user_id))
-    conn.commit()
-    conn.close()
+    with _last_login_lock:
+        if user_id in _last_login_recent:
+            return
+        _last_login_recent[user_id] = True
+    now = _now_iso()
+    try:
+        _write(lambda cur: cur.execute(_SQL_SET_LAST_LOGIN, (now, user_id)))
+    except Exception:
+        # not written (e.g. database busy): let the next login retry
+        with _last_login_lock:
+            _last_login_recent.pop(user_id, None)
+        raise
+    _invalidate_user(user_id)
 
 
 def update_user_name(user_id: str, name: str) -> None:
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET name = ? WHERE id = ?", (name, user_id))
-    conn.commit()
-    conn.close()
+    _write(lambda cur: cur.execute(_SQL_SET_USER_NAME, (name, user_id)))
+    _invalidate_user(user_id)
 
 
 def set_password_hash(user_id: str, hashed_password: str) -> None:
-    conn = _get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET hashed_password = ? WHERE id = ?", (hashed_password, user_id))
-    conn.commit()
-    conn.close()
+    _write(lambda cur: cur.execute(_SQL_SET_PASSWORD_HASH, (hashed_password, user_id)))
+    _invalidate_user(user_id)
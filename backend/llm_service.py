@@ -8,11 +8,129 @@ generate_legal_answer(query, retrieved_docs) -> dict:
   "metadata": { ... }
 }
 """
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+import concurrent.futures
 import logging
+import os
+import re
+import time
 
 logger = logging.getLogger(__name__)
 
+# Patterns used on every retrieved doc / generated answer, compiled once.
+_RE_CODE_FENCE = re.compile(r"```[\s\S]*?```")
+_RE_HEADING = re.compile(r"^#+\s*", re.M)
+_RE_BULLET = re.compile(r"^- \s*", re.M)
+_RE_BRACKET = re.compile(r"\[[^\]]*\]")
+_RE_PAREN = re.compile(r"\([^\)]*\)")
+_RE_WS = re.compile(r"\s+")
+_RE_SENT_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_RE_SENT_BREAK = re.compile(r"[.?!]\s+")
+_RE_TRAIL_DOTS = re.compile(r"\.\.\.+$")
+_RE_NON_ALNUM = re.compile(r"[^0-9a-z\s]")
+# Anything _clean_text would rewrite in an already-stripped string: fence, heading,
+# bracket and paren openers, a leading dash (bullet), or whitespace other than single spaces
+_RE_NEEDS_CLEAN = re.compile(r"[`#\[(]|^-|\s\s|[^\S ]")
+# Sentence terminators for _cut_at_sentence (incl. Devanagari danda, semicolon, ellipsis)
+_RE_TERM = re.compile(r"[.?!।;…]")
+# Greedy prefix: group 1 is the last terminator in the string (found by backtracking from the end)
+_RE_LAST_TERM = re.compile(r"[\s\S]*([.?!।;…])")
+_RE_NON_SPACE = re.compile(r"\S")
+# Non-empty lines under str.splitlines() rules, found lazily
+_RE_LINE = re.compile("[^\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]+")
+
+# Metadata buckets: (keywords, max entries). A line goes into every bucket one
+# of whose keywords occurs in it (case-insensitive substring).
+_META_BUCKETS = (
+    ("sections", ("section", "ipc"), 3),
+    ("penalties", ("punish", "imprison", "fine"), 3),
+    ("key_points", ("intent", "offence", "liable", "guilty", "element", "mens rea", "actus reus"), 4),
+    ("examples", ("illustration", "example"), 2),
+)
+_META_KEYWORD_BUCKET = {kw: b for b, (_, kws, _) in enumerate(_META_BUCKETS) for kw in kws}
+# One scan per line for all keywords; the lookahead reports a match at every
+# position, so keywords overlapping each other are all seen.
+_RE_META_KEYWORD = re.compile(
+    "(?=(" + "|".join(re.escape(kw) for kw in _META_KEYWORD_BUCKET) + "))"
+)
+
+
+@lru_cache(maxsize=4096)
+def _canonical(s: str) -> str:
+    """Normalized comparison key: lowercase, punctuation -> space, spaces collapsed."""
+    k = s or ""
+    k = k.strip().lower()
+    # Remove trailing ellipses and stray punctuation
+    k = _RE_TRAIL_DOTS.sub("", k)
+    # Replace non-alphanumeric (keep spaces) with space
+    k = _RE_NON_ALNUM.sub(" ", k)
+    # Collapse spaces
+    k = _RE_WS.sub(" ", k).strip()
+    return k
+
+
+class _SubstringDedup:
+    """
+    Set of strings answering "is `key` a substring of, or does it contain, any
+    stored string?" without comparing against every stored string.
+
+    Stored strings are indexed by all of their 3-char windows (for "key is
+    inside a stored string": every window of key must occur in it, so the
+    smallest matching bucket is a complete candidate list) and by their first
+    window (for "a stored string is inside key": its first window occurs in
+    key). Strings shorter than 3 chars are few and checked directly.
+    """
+
+    def __init__(self):
+        self._keys: List[str] = []
+        self._exact = set()
+        self._trigrams: Dict[str, List[int]] = {}
+        self._first_trigram: Dict[str, List[int]] = {}
+        self._short: List[str] = []
+
+    def add(self, key: str) -> None:
+        if not key or key in self._exact:
+            return
+        self._exact.add(key)
+        if len(key) < 3:
+            self._short.append(key)
+            return
+        idx = len(self._keys)
+        self._keys.append(key)
+        for tri in {key[i:i + 3] for i in range(len(key) - 2)}:
+            self._trigrams.setdefault(tri, []).append(idx)
+        self._first_trigram.setdefault(key[:3], []).append(idx)
+
+    def contains_or_contained(self, key: str) -> bool:
+        if key in self._exact:
+            return True
+        keys = self._keys
+        # stored strings that are too short to be indexed
+        for short in self._short:
+            if short in key or key in short:
+                return True
+        if len(key) < 3:
+            return any(key in k for k in keys)
+        windows = {key[i:i + 3] for i in range(len(key) - 2)}
+        # key inside a stored string
+        smallest = None
+        for tri in windows:
+            bucket = self._trigrams.get(tri)
+            if bucket is None:
+                smallest = None
+                break
+            if smallest is None or len(bucket) < len(smallest):
+                smallest = bucket
+        if smallest is not None and any(key in keys[i] for i in smallest):
+            return True
+        # a stored string inside key
+        for tri in windows:
+            for i in self._first_trigram.get(tri, ()):
+                if keys[i] in key:
+                    return True
+        return False
+
 
 def _extract_metadata_from_docs(retrieved_docs: List[str]) -> Dict[str, Any]:
     """
@@ -27,61 +145,38 @@ def _extract_metadata_from_docs(retrieved_docs: List[str]) -> Dict[str, Any]:
         return _cut_at_sentence(text, limit)
 
 
-    sections: List[str] = []
-    penalties: List[str] = []
-    key_points: List[str] = []
-    examples: List[str] = []
+    buckets: List[List[str]] = [[] for _ in _META_BUCKETS]
+    limits = [limit for _, _, limit in _META_BUCKETS]
+    # number of buckets that can still take entries
+    open_buckets = len(buckets)
 
     for doc in retrieved_docs:
-        for ln in doc.splitlines():
-            ln = ln.strip()
+        if not open_buckets:
+            break
+        # iterate lines lazily so an early exit doesn't pay for splitting the rest of the doc
+        for m in _RE_LINE.finditer(doc):
+            ln = m.group().strip()
             if not ln:
                 continue
 
-            lower = ln.lower()
-
+            hits = {_META_KEYWORD_BUCKET[m.group(1)] for m in _RE_META_KEYWORD.finditer(ln.lower())}
             # keep short, clean bullets only
-            if ("section" in lower or "ipc" in lower) and len(sections) < 3:
-                sections.append(shorten(ln))
-
-            if any(w in lower for w in ("punish", "imprison", "fine")) and len(penalties) < 3:
-                penalties.append(shorten(ln))
-
-            if any(w in lower for w in ("intent", "offence", "liable", "guilty", "element", "mens rea", "actus reus")) and len(key_points) < 4:
-                key_points.append(shorten(ln))
+            for b in sorted(hits):
+                bucket = buckets[b]
+                if len(bucket) < limits[b]:
+                    bucket.append(shorten(ln))
+                    if len(bucket) == limits[b]:
+                        open_buckets -= 1
+            if not open_buckets:
+                break
 
-            if ("illustration" in lower or "example" in lower) and len(examples) < 2:
-                examples.append(shorten(ln))
+    sections, penalties, key_points, examples = buckets
 
     # Deduplicate near-identical entries across categories while preserving order.
     # Use normalized keys (lowercase, remove punctuation, collapse spaces) and
     # treat substring matches as duplicates to avoid slightly different
     # truncations appearing in multiple lists.
-    import re
-    seen_keys_list = []
-    seen_keys_set = set()
-
-    def _canonical(s: str) -> str:
-        k = s or ""
-        k = k.strip().lower()
-        # Remove trailing ellipses and stray punctuation
-        k = re.sub(r"\.\.\.+$", "", k)
-        # Replace non-alphanumeric (keep spaces) with space
-        k = re.sub(r"[^0-9a-z\s]", " ", k)
-        # Collapse spaces
-        k = re.sub(r"\s+", " ", k).strip()
-        return k
-
-    def _is_duplicate_key(key: str) -> bool:
-        # Exact or substring containment check against previously seen keys
-        if key in seen_keys_set:
-            return True
-        for existing in seen_keys_list:
-            if not existing:
-                continue
-            if key in existing or existing in key:
-                return True
-        return False
+    seen = _SubstringDedup()
 
     def _uniq_preserve(items):
         out = []
@@ -91,10 +186,9 @@ def _extract_metadata_from_docs(retrieved_docs: List[str]) -> Dict[str, Any]:
             key = _canonical(it)
             if not key:
                 continue
-            if _is_duplicate_key(key):
+            if seen.contains_or_contained(key):
                 continue
-            seen_keys_list.append(key)
-            seen_keys_set.add(key)
+            seen.add(key)
             out.append(it)
         return out
 
@@ -118,27 +212,39 @@ def _clean_text(text: str) -> str:
     if not text:
         return ""
     # remove code fences ```...``` and inline ```
-    import re
-    text = re.sub(r"```[\s\S]*?```", " ", text)
+    text = _RE_CODE_FENCE.sub(" ", text)
     # remove markdown headings and bullets markers
-    text = re.sub(r"^#+\s*", "", text, flags=re.M)
-    text = re.sub(r"^- \s*", "", text, flags=re.M)
+    text = _RE_HEADING.sub("", text)
+    text = _RE_BULLET.sub("", text)
     # remove bracketed annotations like [Repealed], [***], citations in brackets
-    text = re.sub(r"\[[^\]]*\]", " ", text)
+    text = _RE_BRACKET.sub(" ", text)
     # remove parenthetical notes (short ones)
-    text = re.sub(r"\([^\)]*\)", " ", text)
+    text = _RE_PAREN.sub(" ", text)
     # collapse multiple whitespace
-    text = re.sub(r"\s+", " ", text).strip()
+    text = _RE_WS.sub(" ", text).strip()
     return text
 
 
+@lru_cache(maxsize=128)
+def _clean_and_split(text: str) -> Tuple[str, Tuple[str, ...]]:
+    """Cleaned text and its sentences; shared by summaries of different lengths."""
+    clean = text.strip()
+    # Plain single-line text (e.g. short answers) is already clean
+    if _RE_NEEDS_CLEAN.search(clean):
+        clean = _clean_text(text)
+    return clean, tuple(s.strip() for s in _RE_SENT_SPLIT.split(clean) if s.strip())
+
+
 def _summarize_text(text: str, n_sentences: int = 3, max_chars: int = 600) -> str:
     """Simple extractive summarizer: return first n sentences (cleaned) up to max_chars."""
     if not text:
         return ""
-    clean = _clean_text(text)
-    import re
-    sentences = [s.strip() for s in re.split(r'(?<=[.!?])\s+', clean) if s.strip()]
+    clean, sentences = _clean_and_split(text)
+    return _take_first(clean, sentences, n_sentences, max_chars)
+
+
+def _take_first(clean: str, sentences: Tuple[str, ...], n_sentences: int, max_chars: int) -> str:
+    """First n of `sentences` (from _clean_and_split) up to max_chars."""
     if not sentences:
         if len(clean) <= max_chars:
             return clean
@@ -239,21 +345,20 @@ def _build_unified_from_meta(query: str, meta: Dict[str, Any]) -> str:
     This consolidates summary, sections, penalties, key points and examples
     into a single coherent block to avoid repeated small cards in the UI.
     """
-    parts: List[str] = []
+    # Output lines, joined once at the end; blocks are separated by a blank line
+    lines: List[str] = []
 
-    def _canonical(s: str) -> str:
-        if not s:
-            return ""
-        k = s.strip().lower()
-        k = re.sub(r"\.\.\.+$", "", k)
-        k = re.sub(r"[^0-9a-z\s]", " ", k)
-        k = re.sub(r"\s+", " ", k).strip()
-        return k
+    def _start_block(header):
+        if lines:
+            lines.append("")
+        lines.append(header)
 
     sa = meta.get("short_answer") or ""
     sa_key = _canonical(sa)
     if sa:
-        parts.append(f"**Summary**\n\n{sa}")
+        _start_block("**Summary**")
+        lines.append("")
+        lines.append(sa)
 
     # Helper to filter items that duplicate or are contained within prior content
     def _filter_items(items, prior_keys):
@@ -282,30 +387,39 @@ def _build_unified_from_meta(query: str, meta: Dict[str, Any]) -> str:
 
     sections = _filter_items(meta.get("sections", []), prior)
     if sections:
-        parts.append("**Relevant IPC Sections:**\n" + "\n".join([f"- {s}" for s in sections]))
+        _start_block("**Relevant IPC Sections:**")
+        for s in sections:
+            lines.append(f"- {s}")
 
     penalties = _filter_items(meta.get("penalties", []), prior)
     if penalties:
-        parts.append("**Punishments / Penalties:**\n" + "\n".join([f"- {p}" for p in penalties]))
+        _start_block("**Punishments / Penalties:**")
+        for p in penalties:
+            lines.append(f"- {p}")
 
     kps = _filter_items(meta.get("key_points", []), prior)
     if kps:
-        parts.append("**Key Legal Points:**\n" + "\n".join([f"{i+1}. {kp}" for i, kp in enumerate(kps)]))
+        _start_block("**Key Legal Points:**")
+        for i, kp in enumerate(kps, 1):
+            lines.append(f"{i}. {kp}")
 
     examples = _filter_items(meta.get("examples", []), prior)
     if examples:
-        parts.append("**Examples:**\n" + "\n".join([f"- {ex}" for ex in examples]))
+        _start_block("**Examples:**")
+        for ex in examples:
+            lines.append(f"- {ex}")
 
     detailed = meta.get("detailed")
     if detailed:
         # Avoid repeating detailed if it duplicates earlier short_answer
         if not sa_key or _canonical(detailed) not in prior:
-            parts.append("**Detailed Explanation:**\n" + detailed)
+            _start_block("**Detailed Explanation:**")
+            lines.append(detailed)
 
-    if not parts:
+    if not lines:
         return "No relevant information found in retrieved documents."
 
-    return "\n\n".join(parts)
+    return "\n".join(lines)
 
 
 def _fallback_generation(query: str, retrieved_docs: List[str]) -> Dict[str, Any]:
@@ -316,9 +430,7 @@ def _fallback_generation(query: str, retrieved_docs: List[str]) -> Dict[str, Any
     if retrieved_docs:
         first = retrieved_docs[0].strip()
         # split by sentence terminators (., ?, !)
-        import re
-
-        sentences = [s.strip() for s in re.split(r"[.?!]\s+", first) if s.strip()]
+        sentences = [s.strip() for s in _RE_SENT_BREAK.split(first) if s.strip()]
         if sentences:
             # Prefer up to 2-3 sentences from the first doc
             short = " ".join(sentences[:3])
@@ -330,8 +442,7 @@ def _fallback_generation(query: str, retrieved_docs: List[str]) -> Dict[str, Any
 
     # If the short summary is too short, try combining the top docs or key points
     if not short or len(short) < 50:
-        combined = "\n\n".join(retrieved_docs[:2])
-        alt = _first_n_sentences(combined, n=3, max_chars=800)
+        alt = _stream_first_n_sentences(retrieved_docs[:2], n=3, max_chars=800)
         if alt and len(alt) > len(short):
             short = alt
         else:
@@ -343,8 +454,7 @@ def _fallback_generation(query: str, retrieved_docs: List[str]) -> Dict[str, Any
 
     detailed = ""
     if retrieved_docs:
-        combined = "\n\n".join(retrieved_docs[:2])
-        detailed = _cut_at_sentence(combined, 4000)
+        detailed = _stream_cut(retrieved_docs[:2], 4000)
 
     metadata = {
         "tldr": tldr,
@@ -360,21 +470,20 @@ def _fallback_generation(query: str, retrieved_docs: List[str]) -> Dict[str, Any
     markdown = _build_unified_from_meta(query, metadata)
     # Ensure the 'short_answer' in metadata summarizes the generated markdown
     try:
-        short_from_md = _summarize_text(markdown, n_sentences=3, max_chars=600)
-        tldr_from_md = _summarize_text(markdown, n_sentences=1, max_chars=250)
-        metadata["short_answer"] = short_from_md
-        metadata["tldr"] = tldr_from_md
+        # clean/split the markdown once for both summaries
+        clean, sentences = _clean_and_split(markdown)
+        metadata["short_answer"] = _take_first(clean, sentences, 3, 600)
+        metadata["tldr"] = _take_first(clean, sentences, 1, 250)
     except Exception:
         pass
     return {"markdown": markdown, "metadata": metadata}
 
 
-# backend/llm_service.py
-import re
-import os
-import time
-import concurrent.futures
-from typing import List, Dict, Any
+# Runs Ollama calls off the request thread. Module-level (not a per-call
+# `with` block) so a timed-out call doesn't hold the request on pool shutdown.
+_OLLAMA_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv("OLLAMA_WORKERS", "4")), thread_name_prefix="ollama"
+)
 
 def _trim_doc(d: str, max_chars=2000):
     if not d:
@@ -394,31 +503,33 @@ def _cut_at_sentence(text: str, max_chars: int):
     s = text.strip()
     if len(s) <= max_chars:
         return s
+    return _cut_long(s, max_chars)
+
 
-    # Define sentence terminators (include Devanagari danda and em-dash/semicolon)
-    terminators = ['.', '?', '!', '।', ';', '…']
+# How far past max_chars _cut_at_sentence may extend to reach a terminator
+_CUT_EXTENSION = 400
 
+
+def _cut_long(s: str, max_chars: int) -> str:
+    """
+    _cut_at_sentence for stripped text longer than max_chars. Only the first
+    max_chars + _CUT_EXTENSION chars are read, so `s` may be just that prefix.
+    """
     snippet = s[:max_chars]
     # find last terminator inside snippet
-    last_sent_end = -1
-    for t in terminators:
-        pos = snippet.rfind(t)
-        if pos > last_sent_end:
-            last_sent_end = pos
+    m = _RE_LAST_TERM.match(snippet)
+    last_sent_end = m.start(1) if m else -1
 
     # if we found a reasonable sentence end (not too early), cut there
     if last_sent_end >= int(max_chars * 0.3):
         return snippet[: last_sent_end + 1].strip() + "..."
 
     # Otherwise, try extending forward a bit to reach the next terminator
-    extension = 400
+    extension = _CUT_EXTENSION
     forward_limit = min(len(s), max_chars + extension)
     forward_slice = s[:forward_limit]
-    next_sent_end = -1
-    for t in terminators:
-        pos = forward_slice.find(t, max_chars)
-        if pos != -1 and (next_sent_end == -1 or pos < next_sent_end):
-            next_sent_end = pos
+    m = _RE_TERM.search(forward_slice, max_chars)
+    next_sent_end = m.start() if m else -1
 
     if next_sent_end != -1 and next_sent_end - max_chars <= extension:
         return forward_slice[: next_sent_end + 1].strip() + "..."
@@ -434,19 +545,84 @@ def _first_n_sentences(text: str, n=2, max_chars=600):
     """
     if not text:
         return ""
-    # split on sentence-ending punctuation followed by whitespace
-    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
+    return _take_sentences(text.strip(), n, max_chars, complete=True)
+
+
+def _take_sentences(text: str, n: int, max_chars: int, complete: bool) -> Optional[str]:
+    """
+    _first_n_sentences over stripped `text`. With complete=False, `text` is only
+    a prefix of the real text; returns None if that prefix ran out first.
+    """
     out = []
     total = 0
-    for s in sentences:
+    start = 0
+    # walk sentence breaks (sentence-ending punctuation followed by whitespace)
+    # lazily, stopping as soon as enough text is collected
+    for m in _RE_SENT_SPLIT.finditer(text):
+        s = text[start:m.start()]
+        start = m.end()
         if not s:
             continue
         out.append(s.strip())
         total += len(s)
         if len(out) >= n or total >= max_chars:
-            break
+            return " ".join(out).strip()
+    if not complete:
+        return None
+    # last sentence (no break after it)
+    if text[start:]:
+        out.append(text[start:].strip())
     return " ".join(out).strip()
 
+
+def _joined_prefix(docs: List[str], sep: str, limit: int) -> Tuple[str, bool]:
+    """
+    First `limit` chars of sep.join(docs).lstrip(), without building the join.
+    The flag is True when nothing but whitespace follows (the prefix is the
+    whole text up to trailing whitespace).
+    """
+    out: List[str] = []
+    size = 0
+    leading = True
+    for i, doc in enumerate(docs):
+        for piece in ((sep, doc) if i else (doc,)):
+            start = 0
+            if leading:
+                m = _RE_NON_SPACE.search(piece)
+                if not m:
+                    continue
+                start, leading = m.start(), False
+            if size >= limit:
+                if _RE_NON_SPACE.search(piece, start):
+                    return "".join(out), False
+                continue
+            take = piece[start:start + limit - size]
+            out.append(take)
+            size += len(take)
+            if _RE_NON_SPACE.search(piece, start + len(take)):
+                return "".join(out), False
+    return "".join(out), True
+
+
+def _stream_first_n_sentences(docs: List[str], n: int, max_chars: int, sep: str = "\n\n") -> str:
+    """_first_n_sentences(sep.join(docs), ...) reading only as much of docs as it needs."""
+    limit = 2 * max_chars + 256
+    while True:
+        text, complete = _joined_prefix(docs, sep, limit)
+        out = _take_sentences(text.rstrip() if complete else text, n, max_chars, complete)
+        if out is not None:
+            return out
+        limit *= 2
+
+
+def _stream_cut(docs: List[str], max_chars: int, sep: str = "\n\n") -> str:
+    """_cut_at_sentence(sep.join(docs), max_chars) reading only as much of docs as it needs."""
+    text, complete = _joined_prefix(docs, sep, max_chars + _CUT_EXTENSION + 1)
+    if complete:
+        return _cut_at_sentence(text, max_chars)
+    # more non-space text follows, so the full stripped text is longer than max_chars
+    return _cut_long(text, max_chars)
+
 def generate_legal_answer(query: str, retrieved_docs: List[str]) -> Dict[str, Any]:
     """
     Main entrypoint used by app.py. Returns {"markdown": str, "metadata": dict}
@@ -483,19 +659,22 @@ User Query: {query}
 
         start = time.time()
         res = None
+        future = _OLLAMA_EXECUTOR.submit(_call_ollama, prompt)
+
+        # Metadata depends only on the retrieved docs: build it while the model runs
+        extracted = _extract_metadata_from_docs(retrieved_docs)
+        detailed = _cut_at_sentence("\n\n".join((retrieved_docs or [""])[:2]), 8000)
+
         try:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
-                future = ex.submit(_call_ollama, prompt)
-                try:
-                    # allow a small buffer beyond the model timeout
-                    res = future.result(timeout=timeout_sec + 2)
-                except concurrent.futures.TimeoutError:
-                    logger.warning("ollama.chat timed out after %ss (model=%s)", timeout_sec, model_name)
-                    try:
-                        future.cancel()
-                    except Exception:
-                        pass
-                    res = None
+            # allow a small buffer beyond the model timeout
+            res = future.result(timeout=max(0.0, start + timeout_sec + 2 - time.time()))
+        except concurrent.futures.TimeoutError:
+            logger.warning("ollama.chat timed out after %ss (model=%s)", timeout_sec, model_name)
+            try:
+                future.cancel()
+            except Exception:
+                pass
+            res = None
         except Exception as e:
             logger.warning("ollama execution failed: %s", e)
 
@@ -513,13 +692,11 @@ User Query: {query}
                 content = str(res)
 
         if content:
-            # produce lightweight metadata (short readable bullets) derived from docs
-            extracted = _extract_metadata_from_docs(retrieved_docs)
-
             # Build short_answer and tldr using the assistant response (content)
             # Summary should reflect the LLM's answer (extractive summarization).
-            short_answer = _summarize_text(content, n_sentences=3, max_chars=600)
-            tldr = _summarize_text(content, n_sentences=1, max_chars=250)
+            clean, sentences = _clean_and_split(content)
+            short_answer = _take_first(clean, sentences, 3, 600)
+            tldr = _take_first(clean, sentences, 1, 250)
 
             # If the extracted short_answer is too short or uninformative, expand it
             if not short_answer or len(short_answer) < 50:
@@ -540,15 +717,16 @@ User Query: {query}
                 "penalties": extracted.get("penalties", [])[:4],
                 "key_points": extracted.get("key_points", [])[:5],
                 "examples": extracted.get("examples", [])[:2],
-                "detailed": _cut_at_sentence("\n\n".join((retrieved_docs or [""])[:2]), 8000),
+                "detailed": detailed,
             }
 
             # Build a single unified markdown from metadata (ChatGPT-like single section)
             markdown = _build_unified_from_meta(query, metadata)
             # Refresh short_answer/tldr based on the unified markdown
             try:
-                metadata["short_answer"] = _summarize_text(markdown, n_sentences=3, max_chars=600)
-                metadata["tldr"] = _summarize_text(markdown, n_sentences=1, max_chars=250)
+                clean, sentences = _clean_and_split(markdown)
+                metadata["short_answer"] = _take_first(clean, sentences, 3, 600)
+                metadata["tldr"] = _take_first(clean, sentences, 1, 250)
             except Exception:
                 pass
 
@@ -4,8 +4,36 @@ import pickle
 from functools import lru_cache
 from typing import Tuple
 
-IPC_PKL = os.getenv("IPC_PKL", "ipc_data.pkl")
+IPC_DOCS = os.getenv("IPC_DOCS", "ipc_data.docs.mp")
+IPC_PKL = os.getenv("IPC_PKL", "ipc_data.pkl")  # legacy pickled build
+IPC_FAISS = os.getenv("IPC_FAISS", "ipc_data.faiss")
 EMBED_MODEL = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+# Number of IVF lists probed per query (ignored for flat indexes)
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+# Graph degree / search breadth used when a legacy flat L2 index is upgraded to HNSW
+HNSW_M = 32
+HNSW_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+
+def _set_nprobe(faiss, index) -> None:
+    # nprobe is a property of the index, so set it once here rather than per query
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = FAISS_NPROBE
+
+def _upgrade_flat_l2(faiss, index):
+    """
+    Older builds stored an exact IndexFlatL2 over raw embeddings. Rebuild it as an
+    inner-product HNSW index over L2-normalized copies of the same vectors, which
+    is what the retriever's normalized queries expect (and is sub-linear).
+    """
+    if type(index) is not faiss.IndexFlatL2 or index.ntotal == 0:
+        return index
+    vectors = index.reconstruct_n(0, index.ntotal)
+    faiss.normalize_L2(vectors)
+    hnsw = faiss.IndexHNSWFlat(index.d, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    hnsw.add(vectors)
+    hnsw.hnsw.efSearch = HNSW_EF_SEARCH
+    return hnsw
 
 @lru_cache(maxsize=1)
 def load_model_data() -> Tuple[object, object, list]:
@@ -31,10 +59,27 @@ def load_model_data() -> Tuple[object, object, list]:
     model = SentenceTransformer(EMBED_MODEL)
 
     # Load index and docs
-    if not os.path.exists(IPC_PKL):
-        raise FileNotFoundError(f"{IPC_PKL} not found. Run build_index/rag.py first.")
-    with open(IPC_PKL, "rb") as f:
-        data = pickle.load(f)
-        index = data["index"]
+    if os.path.exists(IPC_DOCS) and os.path.exists(IPC_FAISS):
+        import faiss
+        import msgpack
+        with open(IPC_DOCS, "rb") as f:
+            docs = msgpack.unpackb(f.read())["docs"]
+        # Memory-map the index read-only instead of copying it into the process
+        # heap: pages come from the OS page cache and are shared across workers
+        index = faiss.read_index(IPC_FAISS, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        _set_nprobe(faiss, index)
+    elif os.path.exists(IPC_PKL):
+        # Older builds pickled the docs (and, before that, the index too)
+        with open(IPC_PKL, "rb") as f:
+            data = pickle.load(f)
         docs = data["docs"]
+        import faiss
+        if os.path.exists(IPC_FAISS):
+            index = faiss.read_index(IPC_FAISS, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            _set_nprobe(faiss, index)
+        else:
+            index = data["index"]
+        index = _upgrade_flat_l2(faiss, index)
+    else:
+        raise FileNotFoundError(f"{IPC_DOCS} not found. Run build_index/rag.py first.")
     return model, index, docs
@@ -7,8 +7,12 @@ if not os.path.exists(DB):
     print("DB file not found:", DB)
     raise SystemExit(1)
 
-conn = sqlite3.connect(DB)
+# isolation_level=None: transactions below are explicit, so everything commits once
+conn = sqlite3.connect(DB, isolation_level=None)
 cur = conn.cursor()
+# Same journal settings the app uses (db._PRAGMAS); WAL is persistent in the file
+cur.execute("PRAGMA journal_mode=WAL;")
+cur.execute("PRAGMA synchronous=NORMAL;")
 
 # Check columns first
 cur.execute("PRAGMA table_info(messages);")
@@ -19,8 +23,11 @@ if "metadata" in cols:
     print("Column 'metadata' already exists — nothing to do.")
 else:
     print("Adding 'metadata' column to messages table...")
+    cur.execute("BEGIN IMMEDIATE;")
     cur.execute("ALTER TABLE messages ADD COLUMN metadata TEXT;")
-    conn.commit()
+    # Chat history (and its metadata) is read per session
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id);")
+    cur.execute("COMMIT;")
     print("Done. New columns:")
     cur.execute("PRAGMA table_info(messages);")
     print([row[1] for row in cur.fetchall()])
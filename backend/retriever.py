@@ -1,30 +1,273 @@
 # backend/retriever.py
 
 from typing import List, Optional, Any
+import hashlib
 import logging
+import os
+import queue
+import re
+import threading
 import time
 import numpy as np
-from collections import OrderedDict
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+from functools import lru_cache
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    njit = None
+    NUMBA_AVAILABLE = False
 
 logger = logging.getLogger(__name__)
 
-# Simple in-memory LRU cache for query embeddings to speed repeated queries
-_EMBED_CACHE_MAX = 512
-_embed_cache = OrderedDict()
+# In-memory LRU cache for query embeddings to speed repeated queries.
+# Entries are keyed by (model, digest of the normalized query); the query text
+# itself is dropped once encoded so long queries don't stay resident.
+_EMBED_CACHE_MAX = 4096
+# Concurrent cache misses are encoded together in one model call. The encoder
+# thread takes whatever is queued plus anything arriving within the window
+# (0 = no waiting: batches form only while a previous encode is running).
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "0"))
+EMBED_BATCH_MAX = 16
+
+
+class _QueryKey:
+    __slots__ = ("digest", "text")
+
+    def __init__(self, query: str):
+        # Case/whitespace-insensitive: the default MiniLM embedder is uncased
+        self.text = query
+        self.digest = hashlib.blake2b(query.strip().lower().encode("utf-8"), digest_size=16).digest()
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    def __eq__(self, other):
+        return isinstance(other, _QueryKey) and self.digest == other.digest
+
+
+@lru_cache(maxsize=_EMBED_CACHE_MAX)
+def _encode_cached(model, key: _QueryKey):
+    """L2-normalized float32 (1, d) embedding of key.text; read-only (shared)."""
+    # Index is searched by inner product on unit vectors (cosine)
+    q_emb = _l2_normalize(_batch_encode(model, key.text))
+    q_emb.setflags(write=False)
+    key.text = None
+    return q_emb
+
+# Recent FAISS hits per query digest (valid doc ids, best first). Searches ask for
+# at least _SEARCH_CACHE_K neighbours so a repeat with a larger top_k still hits.
+_SEARCH_CACHE_MAX = 4096
+_SEARCH_CACHE_K = 8
+_search_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+_search_cache_index = None
+_search_cache_lock = threading.Lock()
+
+
+def _search_cached(model, index, key: _QueryKey, top_k: int) -> List[int]:
+    """Doc ids of the top_k nearest neighbours of key's query (-1/None dropped)."""
+    global _search_cache_index
+    with _search_cache_lock:
+        if _search_cache_index is not index:
+            # a different index (reload): earlier hits are meaningless
+            _search_cache.clear()
+            _search_cache_index = index
+        hit = _search_cache.get(key.digest)
+        if hit is not None and hit[0] >= top_k:
+            _search_cache.move_to_end(key.digest)
+            return list(hit[1][:top_k])
+
+    # Reuses the cached embedding for identical queries
+    q_emb = _encode_cached(model, key)
+    k = max(top_k, _SEARCH_CACHE_K)
+    # Do the search (IndexFlat, IndexIVF, etc.)
+    D, I = index.search(q_emb, k)
+    # I shape: (1, k)
+    indices = []
+    if hasattr(I, "__iter__"):
+        # handle None or -1
+        first_row = I[0] if isinstance(I[0], (list, tuple, np.ndarray)) else I
+        for idx in first_row:
+            if idx is None or (isinstance(idx, (int, np.integer)) and idx < 0):
+                continue
+            indices.append(int(idx))
+
+    with _search_cache_lock:
+        if _search_cache_index is index:
+            _search_cache[key.digest] = (k, tuple(indices))
+            _search_cache.move_to_end(key.digest)
+            if len(_search_cache) > _SEARCH_CACHE_MAX:
+                _search_cache.popitem(last=False)
+    return indices[:top_k]
+
+
+def _model_encode(model, texts: List[str]):
+    if hasattr(model, "encode"):
+        # Many sentence-transformers models accept model.encode(list_of_texts)
+        return model.encode(texts)
+    # Fallback: try calling model(texts)
+    return model(texts)
+
+
+_encode_queue: "queue.Queue" = queue.Queue()
+_encoder_pid: Optional[int] = None
+_encoder_start_lock = threading.Lock()
+
+
+def _encoder_loop(q: "queue.Queue") -> None:
+    window = EMBED_BATCH_WINDOW_MS / 1000.0
+    while True:
+        batch = [q.get()]
+        deadline = time.monotonic() + window
+        while len(batch) < EMBED_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+            except queue.Empty:
+                break
+        _encode_batch(batch)
+
+
+def _encode_batch(batch) -> None:
+    """One model call per distinct model in the batch; rows go back to their futures."""
+    by_model = {}
+    for model, text, fut in batch:
+        if fut.set_running_or_notify_cancel():
+            by_model.setdefault(id(model), (model, []))[1].append((text, fut))
+    for model, items in by_model.values():
+        try:
+            embs = np.asarray(_model_encode(model, [text for text, _ in items]), dtype="float32")
+        except BaseException as e:
+            for _, fut in items:
+                fut.set_exception(e)
+            continue
+        for i, (_, fut) in enumerate(items):
+            fut.set_result(embs[i:i + 1])
+
 
-def _get_cached_embedding(query: str):
-    # Return cached embedding or None
-    v = _embed_cache.get(query)
-    if v is not None:
-        # move to end = most recently used
-        _embed_cache.move_to_end(query)
-    return v
+def _batch_encode(model, text: str) -> np.ndarray:
+    """(1, d) embedding of text, encoded on the shared encoder thread."""
+    global _encoder_pid, _encode_queue
+    pid = os.getpid()
+    if _encoder_pid != pid:
+        # first encode in this process (threads do not survive fork())
+        with _encoder_start_lock:
+            if _encoder_pid != pid:
+                _encode_queue = queue.Queue()
+                threading.Thread(target=_encoder_loop, args=(_encode_queue,), name="query-encoder", daemon=True).start()
+                _encoder_pid = pid
+    fut: Future = Future()
+    _encode_queue.put((model, text, fut))
+    return fut.result()
+
+
+def _l2_normalize(emb):
+    emb = np.asarray(emb, dtype="float32")
+    norms = np.linalg.norm(emb, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return emb / norms
+
+def _scatter_postings_np(indptr, doc_ids, counts, word_ids, mult, n_docs):
+    """out[d] = sum over w in word_ids of mult[w] * tf(w, d), from CSR postings."""
+    starts = indptr[word_ids]
+    lengths = indptr[word_ids + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(n_docs, dtype=np.int64)
+    # flat positions of every posting of every matched word
+    seg_start = np.cumsum(lengths) - lengths
+    pos = np.arange(total) + np.repeat(starts - seg_start, lengths)
+    weights = counts[pos] * np.repeat(mult, lengths)
+    return np.bincount(doc_ids[pos], weights=weights, minlength=n_docs).astype(np.int64)
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, nogil=True)
+    def _scatter_postings(indptr, doc_ids, counts, word_ids, mult, n_docs):
+        out = np.zeros(n_docs, dtype=np.int64)
+        for j in range(word_ids.shape[0]):
+            w = word_ids[j]
+            n = mult[j]
+            for p in range(indptr[w], indptr[w + 1]):
+                out[doc_ids[p]] += n * counts[p]
+        return out
+else:
+    _scatter_postings = _scatter_postings_np
+
+
+class _TextIndex:
+    """
+    Word-level term-frequency index over the casefolded docs, in CSR layout
+    (vocab word -> postings of (doc id, count)).
+
+    Query tokens come from str.split(), so they never contain whitespace and
+    every occurrence of a token inside a doc lies within one whitespace-delimited
+    word. text.count(tok) is therefore the sum over the doc's words w of
+    tf(w) * w.count(tok): scoring only has to look at vocab words containing
+    the token instead of rescanning every doc.
+    """
+
+    def __init__(self, docs: List[str]):
+        self.docs = docs
+        # casefold() is lower() plus the remaining Unicode case folds (e.g. "ß" == "ss")
+        self.folded = [d.casefold() for d in docs]
+        self.short_bonus = np.array([0.1 if len(d) <= 1000 else 0.0 for d in docs])
+
+        vocab = {}
+        word_ids, doc_ids, counts = [], [], []
+        for doc_id, text in enumerate(self.folded):
+            tf = Counter(text.split())
+            word_ids.extend(vocab.setdefault(w, len(vocab)) for w in tf)
+            doc_ids.extend([doc_id] * len(tf))
+            counts.extend(tf.values())
+        words = list(vocab)
+        word_ids = np.asarray(word_ids, dtype=np.int64)
+        order = np.argsort(word_ids, kind="stable")
+        self.indptr = np.searchsorted(word_ids[order], np.arange(len(words) + 1))
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int64)[order]
+        self.counts = np.asarray(counts, dtype=np.int64)[order]
+        # All vocab words joined by a separator that tokens cannot contain, so
+        # one regex scan finds every (non-overlapping) occurrence in every word.
+        self.joined = "\n".join(words)
+        self.offsets = np.cumsum([0] + [len(w) + 1 for w in words[:-1]]) if words else np.zeros(0, dtype=np.int64)
+
+    def token_counts(self, tok: str) -> np.ndarray:
+        """text.count(tok) for every doc."""
+        starts = [m.start() for m in re.finditer(re.escape(tok), self.joined)]
+        if not starts:
+            return np.zeros(len(self.docs), dtype=np.int64)
+        word_ids = np.searchsorted(self.offsets, starts, side="right") - 1
+        word_ids, per_word = np.unique(word_ids, return_counts=True)
+        return _scatter_postings(self.indptr, self.doc_ids, self.counts,
+                                 word_ids.astype(np.int64), per_word.astype(np.int64), len(self.docs))
+
+
+_text_index: Optional[_TextIndex] = None
+_text_index_len = 0
+_text_index_lock = threading.Lock()
+
+
+def _get_text_index(docs: List[str]) -> _TextIndex:
+    # Built once per docs list (the loader hands out the same list every call)
+    global _text_index, _text_index_len
+    idx = _text_index
+    if idx is not None and idx.docs is docs and _text_index_len == len(docs):
+        return idx
+    with _text_index_lock:
+        idx = _text_index
+        if idx is None or idx.docs is not docs or _text_index_len != len(docs):
+            idx = _TextIndex(docs)
+            _text_index, _text_index_len = idx, len(docs)
+    return idx
+
+
+def prepare_text_index(docs: Optional[List[str]]) -> None:
+    """Build the fallback text index ahead of the first query (e.g. at startup)."""
+    if docs:
+        _get_text_index(docs)
 
-def _set_cached_embedding(query: str, emb):
-    _embed_cache[query] = emb
-    _embed_cache.move_to_end(query)
-    if len(_embed_cache) > _EMBED_CACHE_MAX:
-        _embed_cache.popitem(last=False)
 
 def _fallback_text_search(query: str, docs: List[str], top_k: int = 3) -> List[str]:
     """
@@ -34,21 +277,38 @@ def _fallback_text_search(query: str, docs: List[str], top_k: int = 3) -> List[s
     if not docs:
         return []
 
-    q_tokens = [t.lower() for t in query.split() if t.strip()]
-    scores = []
-    for i, d in enumerate(docs):
-        text = d.lower()
-        # count token matches, plus small boost for exact substring
-        score = sum(text.count(tok) for tok in q_tokens)
-        if query.lower().strip() in text:
-            score += 3
-        # slightly reward shorter docs that match (heuristic)
-        score = score + (0 if len(text) > 1000 else 0.1)
-        scores.append((score, i))
-
-    # sort descending by score
-    scores.sort(key=lambda x: x[0], reverse=True)
-    top_indices = [idx for sc, idx in scores if sc > 0][:top_k]
+    tidx = _get_text_index(docs)
+    q_tokens = [t.casefold() for t in query.split() if t.strip()]
+    # count token matches, plus small boost for exact substring
+    score = np.zeros(len(docs), dtype=np.int64)
+    for tok in q_tokens:
+        score += tidx.token_counts(tok)
+    phrase = query.casefold().strip()
+    if not phrase:
+        score += 3
+    elif len(q_tokens) == 1 and q_tokens[0] == phrase:
+        # the phrase is the single token: "phrase in text" == "count > 0"
+        score += 3 * (score > 0)
+    else:
+        # the phrase can only occur in docs containing all of its tokens
+        cand = np.flatnonzero(score > 0) if q_tokens else range(len(docs))
+        folded = tidx.folded
+        for i in cand:
+            if phrase in folded[i]:
+                score[i] += 3
+    # slightly reward shorter docs that match (heuristic)
+    scores = score + tidx.short_bonus
+
+    # top_k by descending score, ties in corpus order
+    if 0 < top_k < len(scores):
+        # O(N) selection: every doc scoring at least the k-th best score (ties
+        # included, in corpus order), then a stable sort of just those
+        kth = np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+        cand = np.flatnonzero(scores >= kth)
+        order = cand[np.argsort(-scores[cand], kind="stable")]
+    else:
+        order = np.argsort(-scores, kind="stable")
+    top_indices = [int(i) for i in order[:top_k] if scores[i] > 0]
     # if no positive matches, return first top_k docs as fallback
     if not top_indices:
         top_indices = list(range(min(len(docs), top_k)))
@@ -88,42 +348,8 @@ def retrieve_relevant_docs(query: str,
     # Use FAISS + model if available
     try:
         if index is not None and model is not None and docs is not None:
-            # Many sentence-transformers models accept model.encode(list_of_texts)
-            # If model has .encode, use that
-            # Try to reuse cached embedding for identical queries
-            q_emb = _get_cached_embedding(query)
-            if q_emb is None:
-                if hasattr(model, "encode"):
-                    # Make sure query embedding shape is correct
-                    q_emb = model.encode([query])
-                else:
-                    # Fallback: try calling model(query)
-                    q_emb = model([query])
-                # Ensure numpy array
-                if hasattr(q_emb, "tolist"):
-                    q_emb = np.array(q_emb)
-                # Cache the embedding for future queries
-                try:
-                    _set_cached_embedding(query, q_emb)
-                except Exception:
-                    pass
-            # Some FAISS indexes expect float32
-            try:
-                q_emb = q_emb.astype("float32")
-            except Exception:
-                pass
-
-            # Do the search (IndexFlat, IndexIVF, etc.)
-            D, I = index.search(q_emb, top_k)
-            # I shape: (1, k)
-            indices = []
-            if hasattr(I, "__iter__"):
-                # handle None or -1
-                first_row = I[0] if isinstance(I[0], (list, tuple, np.ndarray)) else I
-                for idx in first_row:
-                    if idx is None or (isinstance(idx, (int, np.integer)) and idx < 0):
-                        continue
-                    indices.append(int(idx))
+            # Repeated queries reuse the earlier search (and embedding)
+            indices = _search_cached(model, index, _QueryKey(query), top_k)
             # Map to docs
             results = []
             for idx in indices: